@@ -0,0 +1,169 @@
+"""Micro-benchmarks for the hot path of the test harness (request building, templates, stop point selection,
+pretty printing, statistics, stop points loading), to measure the harness's own CPU cost per request.
+
+Each benchmark is timed in isolation (best and median of several repetitions, per call).
+Results are appended to output/benchmarks.csv together with the git commit, and compared to the
+previous results of the same benchmark, so optimisations can be proven and regressions caught.
+
+TIR requests need a prior TR call: it is sent to the local mock server with (almost) no latency.
+
+Usage: python benchmark.py [parameters file]    (like main.py; default: parameters.txt)
+"""
+
+import csv
+import os
+import platform
+import random
+import statistics
+import subprocess
+import timeit
+
+import configuration as config
+from utilities import logging_wrapper as logging
+from utilities import mock_server
+from utilities import object_store as store
+from utilities import prepare
+from utilities import spans
+from utilities import stop_points
+from utilities.datetime_utils import utc_now_iso
+from utilities.parameters import set_param
+from utilities.request_builder import build_request, select_stop_point, add_random_offset_to_coord
+from utilities.statistics_utils import compute_statistics, new_results_table, NA, RESULTS_TABLE_HEADERS
+from utilities.string_utils import pretty_print_xml
+from utilities.template_util import Template
+
+BENCHMARKS_FILE = os.path.join(config.FOLDERS["output"], 'benchmarks.csv')
+# the environment of the mock server, if a local configuration replaces ENVIRONMENTS without it:
+MOCK_ENVIRONMENT = {
+    "apiEndpoint": f"http://{config.MOCK_SERVER['host']}:{config.MOCK_SERVER['port']}/ojp",
+    "authBearerKey": "mock",
+    "supported_requests": {"TR10", "TIR10", "LIR10", "SER10", "TR20", "TIR20", "LIR20", "SER20", "TRIAS2020TR",
+                           "J-S-TRIPSOD"}
+}
+BENCHMARKS_HEADERS = ["timestamp", "commit", "python", "benchmark", "number", "repeat", "best_us", "median_us"]
+REGRESSION_THRESHOLD = 0.2  # flag a benchmark if its median is 20+ % slower than in the previous run
+REPEAT = 5
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except Exception:
+        return NA
+
+
+def _build_request_benchmark(env, rt):
+    def run():
+        store.put("environment", env)
+        store.put("request_type", rt)
+        build_request(1)
+    return run
+
+
+def _template_replace_benchmark():
+    template = Template('TR20_stopplaceref.')
+
+    def run():
+        template.rendered_text = template.template_text
+        for placeholder in ('timestamp', 'arrdep', 'o_didok', 'o_name', 'd_didok', 'd_name', 'via',
+                            'tr_number_of_results', 'tr_include_track_sections', 'tr_include_leg_projection'):
+            template.replace(placeholder, 'value')
+    return run
+
+
+def _select_stop_point_benchmark(use_connections_file: bool):
+    def run():
+        set_param('use_connections_file', str(use_connections_file))
+        select_stop_point('origin', 1)
+    return run
+
+
+def _compute_statistics_benchmark(n_rows: int):
+    headers = new_results_table()
+    # nr, environment, request_type, locations and arrdeptime, calc_time, response_size, return_code, server_time,
+    # phase times [ms], wire_bytes, decompress_time, use_parameters:
+    rows = [[i, 'ENV', 'TR20'] + [NA] * 13 + [random.random(), 1000, '200 OK', NA] + [0.1] * len(spans.PHASES) +
+            [400, 0.0001, False] for i in range(n_rows)]
+    assert len(rows[0]) == len(RESULTS_TABLE_HEADERS)
+
+    def run():
+        store.put("stats", [])
+        store.put("results_table", headers + rows)
+        compute_statistics()
+    return run
+
+
+def benchmarks():
+    """List of (name, function, number of calls per repetition)."""
+    large_tr20_response = mock_server.synthetic_response('TR20', 500 * 1024)
+    result = [(f"build_request {rt}", _build_request_benchmark("MOCK", rt), 200)
+              for rt in ('TR10', 'TR20', 'LIR10', 'LIR20', 'SER10', 'SER20', 'TRIAS2020TR', 'J-S-TRIPSOD')]
+    result += [
+        ("build_request TIR20 (incl. prior TR on mock)", _build_request_benchmark("MOCK", 'TIR20'), 20),
+        ("Template load TR20", lambda: Template('TR20_stopplaceref.'), 500),
+        ("Template replace TR20 (10 placeholders)", _template_replace_benchmark(), 2000),
+        ("select_stop_point random", _select_stop_point_benchmark(False), 5000),
+        ("select_stop_point connections file", _select_stop_point_benchmark(True), 5000),
+        ("add_random_offset_to_coord", lambda: add_random_offset_to_coord((8.54, 47.38), 0.5), 20000),
+        ("pretty_print_xml TR20 response 500 kB", lambda: pretty_print_xml(large_tr20_response), 2),
+        ("compute_statistics 1e6 rows", _compute_statistics_benchmark(1000000), 1),
+        ("stop_points load", stop_points._load_sp, 1),
+    ]
+    return result
+
+
+def _previous_results():
+    previous = {}
+    if os.path.exists(BENCHMARKS_FILE):
+        with open(file=BENCHMARKS_FILE, newline='', encoding='utf-8') as file:
+            for row in csv.DictReader(file, delimiter=';'):
+                previous[row["benchmark"]] = float(row["median_us"])
+    return previous
+
+
+def run_benchmarks():
+    random.seed(42)
+    set_param('save_details', 'False')
+    set_param('sleep_time', '0')
+    set_param('use_geopos', 'False')
+    set_param('use_via', 'True')
+    set_param('use_connections_file', 'True')
+    prepare.load_connections_file()
+    store.put("use_pars", True)
+    config.ENVIRONMENTS.setdefault("MOCK", MOCK_ENVIRONMENT)
+    server = mock_server.start_mock_server(dict(config.MOCK_SERVER, latency_median_ms=0.001, latency_sigma=0.0,
+                                                error_rate=0.0, throttle_rate=0.0))
+
+    previous, timestamp, commit = _previous_results(), utc_now_iso(), _git_commit()
+    results = []
+    try:
+        for name, function, number in benchmarks():
+            times = [t / number * 1e6 for t in timeit.Timer(function).repeat(repeat=REPEAT, number=number)]
+            results.append([timestamp, commit, platform.python_version(), name, number, REPEAT,
+                            round(min(times), 2), round(statistics.median(times), 2)])
+    finally:
+        server.shutdown()
+
+    text = f"Benchmarks (commit {commit}), time per call [us]:"
+    text += f"\n{'benchmark':46s} {'best':>14s} {'median':>14s} {'previous':>14s} {'change':>8s}"
+    for row in results:
+        name, best, median = row[3], row[6], row[7]
+        change, flag = '', ''
+        if name in previous and previous[name] > 0.0:
+            ratio = median / previous[name] - 1.0
+            change = f"{100 * ratio:+.1f}%"
+            flag = '  REGRESSION?' if ratio > REGRESSION_THRESHOLD else ''
+        text += f"\n{name:46s} {best:14.2f} {median:14.2f} {previous.get(name, NA):>14} {change:>8s}{flag}"
+    logging.info(text)
+
+    new_file = not os.path.exists(BENCHMARKS_FILE)
+    with open(file=BENCHMARKS_FILE, mode="a", newline="", encoding='utf-8') as file:
+        writer = csv.writer(file, delimiter=";")
+        if new_file:
+            writer.writerow(BENCHMARKS_HEADERS)
+        writer.writerows(results)
+    logging.info(f"Appended benchmark results to {BENCHMARKS_FILE}.")
+
+
+if __name__ == '__main__':
+    run_benchmarks()
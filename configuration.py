@@ -16,9 +16,14 @@ FOLDERS = {
     "stop_points": "stop_points",
     "templates": 'templates',
     "test_parameters": "test_parameters",
+    "token_cache": ".token_cache",
 }
 
 # OJP service environments, each with a short name like "PROD":
+# instead of a static "authBearerKey", an environment may have an "oauth2" entry with "url_token", "client_id",
+# "client_secret" and "scope" to obtain (and refresh) a token, see local_configuration_example.py.
+# Optional compression (see utilities/compression.py): "request_compression": "gzip", "accept_encoding": "gzip, br"
+# Optional "timeouts": (connect, read) in seconds, instead of parameters connect_timeout and read_timeout.
 ENVIRONMENTS = {
     "OJP20PROD": {
         "apiEndpoint": "https://api.opentransportdata.swiss/ojp20",
@@ -34,11 +39,34 @@ ENVIRONMENTS = {
         "apiEndpoint": "https://api.opentransportdata.swiss/trias2020",
         "authBearerKey": "...",
         "supported_requests": {"TRIAS2020TR"}
+    },
+    "MOCK": {
+        "apiEndpoint": "http://localhost:8099/ojp",
+        "authBearerKey": "mock",
+        "supported_requests": {"TR10", "TIR10", "LIR10", "SER10", "TR20", "TIR20", "LIR20", "SER20", "TRIAS2020TR",
+                               "J-S-TRIPSOD"}
     }
 }
 
-# URL of the Service Points data file (list of stations/stops in Swiss public transport)
+# local mock server (see utilities/mock_server.py), e.g. for environment "MOCK" above:
+MOCK_SERVER = {
+    "host": "localhost",
+    "port": 8099,
+    "latency_median_ms": 250,  # log-normal distribution of the latency, with median and sigma:
+    "latency_sigma": 0.5,
+    "error_rate": 0.01,  # share of responses with 500 Internal Server Error
+    "throttle_rate": 0.0,  # share of responses with 429 Too Many Requests
+    "response_kbytes": {"TR10": 60, "TR20": 80, "TIR10": 15, "TIR20": 15, "LIR10": 8, "LIR20": 8,
+                        "SER10": 30, "SER20": 30, "TRIAS2020TR": 60, "J-S-TRIPSOD": 50, "default": 20},
+    "recorded_responses_folder": None,  # e.g. a test directory of a run with save_details = True
+    "files_folder": None,  # files served by GET /files/<name> (with ETag), e.g. a service points ZIP file
+}
+
+# URL of the Service Points data file (list of stations/stops in Swiss public transport);
+# for a test of the download, e.g. "http://localhost:8099/files/service_points.zip" with the mock server:
 SP_PERMALINK = "https://opentransportdata.swiss/de/dataset/service-points-actual-date/permalink"
+SP_DOWNLOAD_TIMEOUT = (10.0, 300.0)  # (connect, read) in seconds
+SP_MAX_AGE_DAYS = 7  # check for a new version (conditional download) when the file is older
 
 # if there exists a local_configuration, it is used and may supersede some of the above constants.
 try:
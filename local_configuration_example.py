@@ -7,18 +7,13 @@ Local configuration that will be imported at the end of configuration.py:
 """
 
 
-# configuration and OAuth2 token for Journey Service (J-S PROD service):
+# configuration for OAuth2 tokens for Journey Service (J-S PROD service), obtained and refreshed by the harness:
 # https://developer.sbb.ch/apis/journey-service/documentation
-from utilities.oauth_utils import OAuth2Helper
-
 J_S_URL_TOKEN = "... URL of the OAuth2 Authorization Server to obtain a token."
 J_S_SCOPE = "... scope to obtain a token ..."
 J_S_CLIENT_ID = "... client ID to obtain a token ..."
 J_S_CLIENT_SECRET = "... client secret to obtain a token ..."
 J_S_URL_API = "https://journey-service.api.sbb.ch:443/v3/trips/by-origin-destination"
-oauth_helper = OAuth2Helper(url_token=J_S_URL_TOKEN, scope=J_S_SCOPE, client_id=J_S_CLIENT_ID,
-                                client_secret=J_S_CLIENT_SECRET)
-j_s_token = oauth_helper.get_token()
 
 
 # environments - will supersede the variable in configuration.py:
@@ -40,8 +35,16 @@ ENVIRONMENTS = {
     },
     "J-S-PROD": {
         "apiEndpoint": J_S_URL_API,
-        "authBearerKey": j_s_token,
+        "oauth2": {"url_token": J_S_URL_TOKEN, "scope": J_S_SCOPE, "client_id": J_S_CLIENT_ID,
+                   "client_secret": J_S_CLIENT_SECRET},
         "supported_requests": {"J-S-TRIPSOD"}
+    },
+    # local mock server (see MOCK_SERVER in configuration.py, parameter start_mock_server), also used by benchmark.py:
+    "MOCK": {
+        "apiEndpoint": "http://localhost:8099/ojp",
+        "authBearerKey": "mock",
+        "supported_requests": {"TR10", "TIR10", "LIR10", "SER10", "TR20", "TIR20", "LIR20", "SER20", "TRIAS2020TR",
+                               "J-S-TRIPSOD"}
     }
 }
 
@@ -6,19 +6,36 @@ See: https://github.com/openTdataCH/ojpch-performance-test
 Matthias Günter, Diogo Ferreira, Markus Meier, Thomas Odermatt
 """
 
+import math
+import queue
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
 import configuration as config
+from utilities import attribution
+from utilities import compression
+from utilities import credentials
 from utilities import logging_wrapper as logging
+from utilities import mock_server
 from utilities import object_store as store
 from utilities import prepare
-from utilities.datetime_utils import sleep_to_avoid_quota_exceeding
+from utilities import profiling
+from utilities import replay
+from utilities import run_control
+from utilities import spans
+from utilities import stop_sampler
+from utilities.datetime_utils import sleep_to_avoid_quota_exceeding, sleep_until
 from utilities.file_utils import save_file
-from utilities.http_utils import http_post
+from utilities.http_utils import http_post, abort_requests, FailedResponse
 from utilities.math_utils import rnd
 from utilities.opensearch_uploader import upload_stats_to_opensearch
 from utilities.parameters import param, param_true
 from utilities.request_builder import build_request, request_type_w_or_wo_parameters_selector
 from utilities.statistics_utils import save_statistics, compute_statistics, save_results_table_csv_file, \
-    new_results_table
+    new_results_table, NA
+from utilities.traffic_mix import parse_traffic_mix, select_from_mix, mix_label
 from utilities.string_utils import pretty_print_xml, pretty_print_json
 
 
@@ -26,8 +43,10 @@ def send_request(call_number):
     env, rt = store.fetch("environment"), store.fetch("request_type")
     rt_plus = rt + "+" if store.fetch("use_pars") else rt
     retries, res, body = 10, None, None
-    while retries > 0:
-        res, body = build_request(call_number)
+    spans.start_request()
+    while retries > 0 and not run_control.should_stop():
+        with spans.span('build'):
+            res, body = build_request(call_number)
         if body:
             break
 
@@ -36,30 +55,42 @@ def send_request(call_number):
 
     if body is None:
         logging.warning(f"- {call_number:02d}, {env:10s}, {rt_plus:12s}, failed to obtain a valid body.")
+        spans.end_request()
         return -1
     else:
         response, calc_time = http_post(env, body)
-        resp_text = response.content.decode('utf-8')
-        n_bytes = len(response.content)
-        code_n_reason = str(response.status_code) + ' ' + str(response.reason)
-        if response.status_code != 200:
-            code_n_reason += ' / DATA ERROR!'
-        elif 'ServiceDelivery' not in str(resp_text) and "trips" not in str(resp_text):
-            code_n_reason += ' / NO <ServiceDelivery>/"trips" IN ANSWER!'
+        with spans.span('validate'):
+            resp_text = response.content.decode('utf-8')
+            n_bytes = len(response.content)
+            code_n_reason = str(response.status_code) + ' ' + str(response.reason)
+            if isinstance(response, FailedResponse):
+                code_n_reason = response.reason
+            elif response.status_code != 200:
+                code_n_reason += ' / DATA ERROR!'
+            elif 'ServiceDelivery' not in str(resp_text) and "trips" not in str(resp_text):
+                code_n_reason += ' / NO <ServiceDelivery>/"trips" IN ANSWER!'
 
-        res = [call_number, env] + res + [rnd(calc_time), n_bytes, code_n_reason]
-        store.fetch("results_table").append(res)
+            server_time = response.headers.get(mock_server.SERVER_TIME_HEADER)
+            res = [call_number, env] + res + [rnd(calc_time), n_bytes, code_n_reason,
+                                              rnd(float(server_time)) if server_time else NA]
 
         if param_true('save_details'):
-            is_json = resp_text.strip().startswith('{')
-            text = pretty_print_json(resp_text) if is_json else pretty_print_xml(resp_text)
-            plus = "+" if store.fetch("use_pars") else ""
-            ending = 'json' if is_json else 'xml'
-            save_file(store.fetch("test_directory"), f"{env}_{rt}{plus}_{call_number:04d}_response_{response.status_code}.{ending}", text)
-
-        a, b, via = res[3], res[7], res[11]
-        logging.log1connection(nr=call_number, env=env, req=rt_plus, a=a, b=b, via=via, ms=round(1000*calc_time),
-                               bytes=len(response.content), code_n_reason=code_n_reason)
+            with spans.span('save_details'):
+                is_json = resp_text.strip().startswith('{')
+                text = pretty_print_json(resp_text) if is_json else pretty_print_xml(resp_text)
+                plus = "+" if store.fetch("use_pars") else ""
+                ending = 'json' if is_json else 'xml'
+                save_file(store.fetch("test_directory"), f"{env}_{rt}{plus}{compression.file_tag()}_{call_number:04d}"
+                                                        f"_response_{response.status_code}.{ending}", text)
+
+        with spans.span('log'):
+            a, b, via = res[3], res[7], res[11]
+            logging.log1connection(nr=call_number, env=env, req=rt_plus, a=a, b=b, via=via, ms=round(1000*calc_time),
+                                   bytes=len(response.content), code_n_reason=code_n_reason,
+                                   message=str(response.error) if isinstance(response, FailedResponse) else "")
+        res += spans.end_request()  # the row in the results table gets the phase times
+        res += [response.wire_bytes, rnd(response.decompress_time), bool(store.fetch("use_pars"))]
+        store.fetch("results_table").append(res)  # complete rows only, see RESULTS_TABLE_HEADERS
     return calc_time
 
 
@@ -68,37 +99,270 @@ def test_run():
     logging.info(f"""{n_calls} tests on {store.fetch("environment")} with {store.fetch("request_type")}"""
                  f""" with{'' if store.fetch("use_pars") else 'out'} parameters:""")
     store.put("results_table", new_results_table())
-    for i in range(0, n_calls):
-        send_request(i + 1)
-        sleep_to_avoid_quota_exceeding()
-    compute_statistics()
-    save_results_table_csv_file()
+    spans.start_cell()
+    try:
+        for i in range(0, n_calls):
+            if run_control.should_stop():
+                logging.warning(f"Test stopped after {i} requests: {run_control.stop_reason()}.")
+                break
+            send_request(i + 1)
+            with spans.span('sleep'):
+                sleep_to_avoid_quota_exceeding()
+    finally:  # also save partial results
+        compute_statistics()
+        save_results_table_csv_file()
+
+
+def mix_run():
+    """Run a weighted mix of request types on one environment, interleaved at random, at a target aggregate rate
+    (sent by a pool of traffic_mix_workers threads, see _send_scheduled). Statistics are computed per request type
+    of the mix, the results table is saved as one file."""
+    env, n_calls = store.fetch("environment"), param('number_of_requests', int)
+    rate = param('traffic_mix_rate', float)
+    mix = parse_traffic_mix(param('traffic_mix'))
+    unsupported = [rt for rt, _, _ in mix if rt not in config.ENVIRONMENTS[env]["supported_requests"]]
+    if unsupported:
+        logging.warning(f"Traffic mix on {env}: request types {unsupported} are not supported and left out.")
+        mix = [m for m in mix if m[0] not in unsupported]
+    if not mix:
+        return
+
+    logging.info(f"{n_calls} tests on {env} with traffic mix {mix_label(mix)} at {rate} requests/s:")
+    arrivals = [(i / rate,) + select_from_mix(mix) for i in range(n_calls)]
+    rows, lags = {}, {}
+    store.put("mix", True)
+    store.put("results_table", new_results_table())
+    spans.start_cell()
+    try:
+        _send_scheduled(arrivals, param('traffic_mix_workers', int), "Traffic mix", rows, lags)
+    finally:  # also save partial results
+        _compute_statistics_by_type(arrivals, rows)
+        save_results_table_csv_file('mix')
+        store.put("mix", False)
+
+
+def _dispatch_worker(scope: dict, dispatch: queue.Queue, rows: dict, lags: dict, start: float):
+    """Send the requests, as they are dispatched, in a cell scope of its own (session, phase times), each request
+    with a random generator of its own seed, so the workload does not depend on which worker sends it."""
+    with store.cell_scope(**scope):
+        spans.start_cell()
+        own_results = new_results_table()
+        store.put("results_table", own_results)
+        try:
+            for nr, (t, rt, use_pars), seed in iter(dispatch.get, None):
+                lags[nr] = time.monotonic() - start - t
+                store.put("rng", random.Random(seed))
+                store.put("request_type", rt)
+                store.put("use_pars", use_pars)
+                n_rows = len(own_results)
+                try:
+                    send_request(nr)
+                except Exception as e:
+                    logging.warning(f"Request {nr} failed because of error: {str(e)}")
+                if len(own_results) > n_rows:
+                    rows[nr] = own_results[-1]
+        finally:
+            if store.fetch("session") is not None:
+                store.fetch("session").close()
+
+
+def _send_scheduled(arrivals: list, n_workers: int, name: str, rows: dict, lags: dict):
+    """Send the arrivals [(time [s] from now, request_type, use_pars), ...] on schedule, by a pool of n_workers
+    threads, so slow responses do not delay later arrivals. Fills rows (of the results table) and lags (of the
+    dispatch behind the schedule [s]) by arrival number (1, 2, ...), and logs the achieved rate."""
+    if not arrivals:
+        return
+    # a seed per arrival, drawn in order before sending, so runs with a random_seed are repeatable:
+    seeds = [store.fetch("rng").randrange(2 ** 32) for _ in arrivals]
+    dispatch, workers = queue.Queue(), []
+    start = time.monotonic()
+    for i in range(n_workers):
+        scope = dict(store.current_scope(), rng=None, session=None)
+        workers.append(threading.Thread(target=_dispatch_worker, args=(scope, dispatch, rows, lags, start),
+                                        name=f"{threading.current_thread().name}_worker_{i}"))
+    for worker in workers:
+        worker.start()
+    try:
+        for nr, ((t, rt, use_pars), seed) in enumerate(zip(arrivals, seeds), start=1):
+            with spans.span('sleep'):
+                sleep_until(start + t)
+            if run_control.should_stop():
+                logging.warning(f"{name} stopped after {nr - 1} requests: {run_control.stop_reason()}.")
+                break
+            dispatch.put((nr, (t, rt, use_pars), seed))
+    finally:
+        for _ in workers:
+            dispatch.put(None)
+        for worker in workers:
+            worker.join()
+
+    # rates from the first to the last arrival, as scheduled and as sent:
+    sent = sorted(arrivals[nr - 1][0] + lag for nr, lag in lags.items())
+    scheduled_rate = (len(arrivals) - 1) / arrivals[-1][0] if arrivals[-1][0] > 0 else math.inf
+    sent_rate = (len(sent) - 1) / (sent[-1] - sent[0]) if len(sent) > 1 and sent[-1] > sent[0] else math.inf
+    max_lag = max(lags.values(), default=0.0)
+    logging.info(f"{name}: {len(sent)} requests sent at {sent_rate:.2f} requests/s (scheduled: {scheduled_rate:.2f}"
+                 f" requests/s), max. lag behind schedule {max_lag:.2f} s.")
+    late = [lag for lag in lags.values() if lag > 1.0]
+    if late:
+        logging.warning(f"{name}: {len(late)} requests were sent more than 1 s late (max. {max_lag:.1f} s), "
+                        f"consider more workers.")
+
+
+def _compute_statistics_by_type(arrivals: list, rows: dict):
+    """Compute the statistics per request type (and wo/w parameters) of scheduled arrivals, and put the results
+    table of all of them (in order of arrival) into the store."""
+    for rt, use_pars in sorted({(rt, use_pars) for _, rt, use_pars in arrivals}):
+        store.put("request_type", rt)
+        store.put("use_pars", use_pars)
+        store.put("results_table", new_results_table() + [rows[nr] for nr in sorted(rows)
+                                                          if arrivals[nr - 1][1:] == (rt, use_pars)])
+        compute_statistics()
+    store.put("results_table", new_results_table() + [rows[nr] for nr in sorted(rows)])
+
+
+def replay_run():
+    """Replay the arrivals of a trace (see utilities/replay.py) on one environment, time-compressed, sent by a pool
+    of replay_workers threads (see _send_scheduled). Statistics are computed per request type, and along the
+    timeline of the trace; the results table is saved as one file."""
+    env, compression_factor = store.fetch("environment"), param('replay_time_compression', float)
+    arrivals, begin = replay.load_schedule(store.fetch("rng"))
+    unsupported = sorted({rt for _, rt, _ in arrivals if rt not in config.ENVIRONMENTS[env]["supported_requests"]})
+    if unsupported:
+        logging.warning(f"Replay on {env}: request types {unsupported} are not supported and left out.")
+        arrivals = [a for a in arrivals if a[1] not in unsupported]
+    if not arrivals:
+        return
+
+    duration = arrivals[-1][0] / compression_factor
+    logging.info(f"Replay of {len(arrivals)} requests on {env} from {param('replay_file')}, "
+                 f"{compression_factor:g}x faster, in {duration:.0f} s:")
+    rows, lags = {}, {}
+    store.put("replay", True)
+    store.put("results_table", new_results_table())
+    spans.start_cell()
+    try:
+        _send_scheduled([(t / compression_factor, rt, use_pars) for t, rt, use_pars in arrivals],
+                        param('replay_workers', int), "Replay", rows, lags)
+    finally:  # also save partial results
+        _compute_statistics_by_type(arrivals, rows)
+        save_results_table_csv_file('replay')
+        tag = 'replay' + ("_" + store.fetch("compression") if store.fetch("compression") else "")
+        replay.save_timeline(arrivals, rows, lags, begin, param('replay_timeline_minutes', float),
+                             compression_factor, tag)
+        store.put("replay", False)
+
+
+def run_cell(cell_index, environment, request_type, use_pars, compression_mode, seed):
+    """Run one cell of the test matrix (environment x request type x wo/w parameters [x wo/w compression], or a
+    traffic mix or a trace replay if request_type is None), with its own state in a cell scope of the store and its
+    own random generator."""
+    with store.cell_scope(cell=cell_index, environment=environment, request_type=request_type, use_pars=use_pars,
+                          compression=compression_mode, rng=random.Random(seed)):
+        run_control.start_cell()
+        try:
+            with profiling.profiled_cell():
+                if param_true('use_replay'):
+                    replay_run()
+                elif request_type is None:
+                    mix_run()
+                else:
+                    test_run()
+        except Exception as e:
+            logging.warning(f"Test skipped because of error: {str(e)}")
+        finally:
+            if store.fetch("session") is not None:
+                store.fetch("session").close()
+
+
+def _wait_or_cancel(futures):
+    """Wait for the futures in short steps, so Ctrl-C (KeyboardInterrupt) is handled at once: it cancels the run,
+    aborts the requests in flight (recorded as CONNECTION_ERROR), and the cells end."""
+    try:
+        while wait(futures, timeout=0.5).not_done:
+            pass
+    except KeyboardInterrupt:
+        run_control.cancel("Ctrl-C")
+        abort_requests()
+        wait(futures)
+
+
+def run_cells(cells):
+    """Run the cells of the test matrix: the cells of an environment with up to 'parallel_cells' (or parameter
+    parallel_cells_per_environment) at a time, all environments at the same time if concurrent_environments."""
+    seed = param('random_seed', int) if param_true('use_random_seed') else random.randrange(2 ** 32)
+    cells_by_env, workloads = {}, {}
+    for i, (environment, request_type, use_pars, compression_mode) in enumerate(cells):
+        # cells differing only in compression mode get the same seed, i.e. identical workloads:
+        workload = workloads.setdefault((environment, request_type, use_pars), len(workloads))
+        cells_by_env.setdefault(environment, []).append((i, environment, request_type, use_pars, compression_mode,
+                                                         seed + workload))
+
+    executors, futures = [], []
+    for environment, env_cells in cells_by_env.items():
+        n_parallel = config.ENVIRONMENTS[environment].get("parallel_cells",
+                                                          param('parallel_cells_per_environment', int))
+        executor = ThreadPoolExecutor(max_workers=n_parallel, thread_name_prefix=environment)
+        executors.append(executor)
+        env_futures = [executor.submit(run_cell, *cell) for cell in env_cells]
+        if not param_true('concurrent_environments'):
+            _wait_or_cancel(env_futures)
+        futures += env_futures
+    _wait_or_cancel(futures)
+    for executor in executors:
+        executor.shutdown()
+    for (_, environment, request_type, use_pars, compression_mode, _), future in zip(
+            [cell for env_cells in cells_by_env.values() for cell in env_cells], futures):
+        if future.exception() is not None:
+            logging.warning(f"Test cell {environment} {request_type or 'mix/replay'}{'+' if use_pars else ''}"
+                            f"{' ' + compression_mode if compression_mode else ''} failed because of error: "
+                            f"{future.exception()!r}")
+
+    # same order of statistics as in a sequential run:
+    store.fetch("stats").sort(key=lambda stat: stat['cell'])
 
 
 def process():
     prepare.set_random_seed()
     prepare.prepare_directories()
     prepare.load_connections_file()
+    stop_sampler.prepare_stop_sampler()
     store.put("stats", [])
     environments = [e.strip() for e in param('environments').split(',')]
     request_types = [rt.strip() for rt in param('request_types').split(',')]
     prepare.remove_old_test_directories()
     prepare.create_test_directory()
+    prepare.configure_logging()
+    profiling.start()
+    credentials.start(environments)
+    run_control.start_run()
+    server = None
+    if param_true('start_mock_server'):
+        server = mock_server.start_mock_server()
+        logging.info(f"Started mock server on http://{config.MOCK_SERVER['host']}:{config.MOCK_SERVER['port']}/.")
+    compression_modes = [compression.PLAIN, compression.COMPRESSED] if param_true('compression_comparison') else [None]
+    cells = []
     for environment in environments:
+        if param_true('use_replay') or param_true('use_traffic_mix'):
+            cells += [(environment, None, False, mode) for mode in compression_modes]
+            continue
         for request_type in request_types:
             rt, wo_w_pars = request_type_w_or_wo_parameters_selector(request_type)
             if rt in config.ENVIRONMENTS[environment]["supported_requests"]:
                 for use_pars in wo_w_pars:
-                    try:
-                        store.put("environment", environment)
-                        store.put("request_type", rt)
-                        store.put("use_pars", use_pars)
-                        test_run()
-                    except Exception as e:
-                        logging.warning(f"Test skipped because of error: {str(e)}")
+                    cells += [(environment, rt, use_pars, mode) for mode in compression_modes]
+    run_cells(cells)
+    credentials.stop()
+    profiling.stop_and_save()
+    if server:
+        server.shutdown()
+        logging.info(f"Stopped mock server, counts: {server.counts}.")
     save_statistics()
+    if param_true('latency_attribution'):
+        attribution.save_attribution()
     upload_stats_to_opensearch()
     logging.copy_log_file_to_test_directory()
+    prepare.ingest_run_history()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,36 @@
+"""Provides a class AliasTable for drawing random indices from a discrete, weighted distribution
+in constant time, using Walker's alias method (in the numerically stable variant of M. Vose).
+
+Setup is O(n), each draw is O(1): one uniform index and one biased coin flip, regardless of n.
+
+Usage example: t = AliasTable([5.0, 1.0, 4.0]) ; i = t.sample() ; # i is 0 with prob. 0.5, 1 with 0.1, 2 with 0.4"""
+
+import random
+
+
+class AliasTable:
+
+    def __init__(self, weights: list):
+        n = len(weights)
+        total = float(sum(weights))
+        if n < 1 or total <= 0.0 or min(weights) < 0.0:
+            raise ValueError("ERROR: alias table needs 1+ non-negative weights with a positive sum.")
+
+        self.n = n
+        self.prob = [0.0] * n
+        self.alias = list(range(n))
+        scaled = [w * n / total for w in weights]
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            self.prob[s], self.alias[s] = scaled[s], l
+            scaled[l] = scaled[l] + scaled[s] - 1.0
+            (small if scaled[l] < 1.0 else large).append(l)
+        for i in small + large:  # left-overs are (up to rounding errors) exactly 1.0
+            self.prob[i] = 1.0
+
+    def sample(self, rng=random) -> int:
+        """Draw a random index according to the weights, in O(1)."""
+        i = int(rng.random() * self.n)
+        return i if rng.random() < self.prob[i] else self.alias[i]
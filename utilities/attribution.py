@@ -0,0 +1,147 @@
+"""A module to attribute latency (calc. time) to request characteristics, if parameter latency_attribution = True.
+
+From the results table of each test cell, the successful (200 ok) requests are described by:
+- the O/D distance [km] (haversine, from the origin and destination coordinates; n/a without a destination),
+- via or no via,
+- with or without parameters (as the cell),
+- the response size.
+The calc. time is then bucketed by distance band, via, parameters and response size decile (per environment and
+request type), and per cell a linear regression (least squares) of the calc. time on distance, via and response
+size is fitted. Both are saved as _attribution.txt in the test directory.
+"""
+
+import math
+import statistics
+
+from utilities import object_store as store
+from utilities.file_utils import save_file
+from utilities.math_utils import calc_percentile
+
+EARTH_RADIUS_KM = 6371.0
+DISTANCE_BANDS_KM = (10, 25, 50, 100, 200)  # upper limits; the last band is open
+NA = 'n/a'
+
+# columns of the results table (see statistics_utils.RESULTS_TABLE_HEADERS):
+_O_LON, _O_LAT, _D_DIDOK, _D_LON, _D_LAT, _V_DIDOK, _CALC_TIME, _SIZE, _CODE = 5, 6, 8, 9, 10, 12, 16, 17, 18
+
+
+def haversine_km(lon1: float, lat1: float, lon2: float, lat2: float) -> float:
+    """Great-circle distance [km] between two WGS84 positions."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    a = math.sin((phi2 - phi1) / 2) ** 2 + \
+        math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def features(results_table: list) -> dict:
+    """Features and calc. times [ms] of the successful requests of a results table, as columns (one pass per
+    column rather than per row): distance [km] (None without a destination), via (0/1), size [bytes], ms."""
+    rows = [row for row in results_table[1:] if row[_CODE].startswith('200')]
+    has_dest = [row[_D_DIDOK] != NA for row in rows]
+    distances = [haversine_km(o_lon, o_lat, d_lon, d_lat) if dest else None for o_lon, o_lat, d_lon, d_lat, dest in
+                 zip([r[_O_LON] for r in rows], [r[_O_LAT] for r in rows], [r[_D_LON] for r in rows],
+                     [r[_D_LAT] for r in rows], has_dest)]
+    return {'distance': distances,
+            'via': [int(row[_V_DIDOK] != NA) for row in rows],
+            'size': [row[_SIZE] for row in rows],
+            'ms': [1000 * row[_CALC_TIME] for row in rows]}
+
+
+def distance_band(km: float) -> str:
+    if km is None:
+        return NA
+    lower = 0
+    for upper in DISTANCE_BANDS_KM:
+        if km < upper:
+            return f"{lower}-{upper} km"
+        lower = upper
+    return f">{lower} km"
+
+
+def fit(columns: dict, names: list) -> dict:
+    """Least squares fit of ms = b0 + sum(b_i * x_i) over the named feature columns (features which are constant
+    or n/a in the cell are left out). Returns {'n', 'r2', 'coefficients': {name: value}}, or None if not possible."""
+    ok = [i for i in range(len(columns['ms'])) if all(columns[name][i] is not None for name in names)]
+    names = [name for name in names if len(set(columns[name][i] for i in ok)) > 1]
+    if len(ok) <= len(names) + 1:
+        return None
+    x = [[1.0] + [float(columns[name][i]) for name in names] for i in ok]
+    y = [columns['ms'][i] for i in ok]
+    k = len(names) + 1
+    # normal equations (X'X) b = X'y, solved by Gauss-Jordan elimination with partial pivoting:
+    a = [[sum(row[r] * row[c] for row in x) for c in range(k)] + [sum(row[r] * v for row, v in zip(x, y))]
+         for r in range(k)]
+    for c in range(k):
+        pivot = max(range(c, k), key=lambda r: abs(a[r][c]))
+        if abs(a[pivot][c]) < 1e-12:
+            return None
+        a[c], a[pivot] = a[pivot], a[c]
+        for r in range(k):
+            if r != c:
+                factor = a[r][c] / a[c][c]
+                a[r] = [v - factor * w for v, w in zip(a[r], a[c])]
+    b = [a[r][k] / a[r][r] for r in range(k)]
+    y_mean = statistics.mean(y)
+    ss_tot = sum((v - y_mean) ** 2 for v in y)
+    ss_res = sum((v - sum(bi * xi for bi, xi in zip(b, row))) ** 2 for row, v in zip(x, y))
+    return {'n': len(ok), 'r2': 1.0 - ss_res / ss_tot if ss_tot > 0 else NA,
+            'coefficients': dict(zip(['intercept'] + names, b))}
+
+
+def _bucket_lines(label: str, buckets: dict) -> str:
+    text = ''
+    for bucket, ms in buckets.items():
+        text += f"\n{label:14s} {bucket:24s} {len(ms):8d} {statistics.mean(ms):10.0f} " \
+                f"{calc_percentile(ms, 50.0):10.0f} {calc_percentile(ms, 90.0):10.0f}"
+    return text
+
+
+def save_attribution():
+    """Save buckets and regressions of all cells (from the stats, see statistics_utils.compute_statistics)."""
+    stats = [e for e in store.fetch("stats") if e.get('attribution')]
+    groups = {}
+    for e in stats:
+        groups.setdefault((e['environment'], e['request'], e.get('compression')), []).append(e)
+
+    text = 'Latency attribution, calc. time of successful requests [ms]'
+    for (environment, request, compression), cells in groups.items():
+        text += f"\n\n{environment} {request}" + (f" {compression}" if compression else "")
+        text += '\ndimension      bucket                          n    average        p50        p90'
+        by_band, by_via, by_pars, sizes = {}, {}, {}, []
+        for e in cells:
+            columns = e['attribution']
+            for km, via, size, ms in zip(columns['distance'], columns['via'], columns['size'], columns['ms']):
+                by_band.setdefault(distance_band(km), []).append(ms)
+                by_via.setdefault('via' if via else 'no via', []).append(ms)
+                by_pars.setdefault('with parameters' if e['use_parameters'] else 'without parameters', []).append(ms)
+                sizes.append((size, ms))
+        bands = [distance_band(upper - 1) for upper in DISTANCE_BANDS_KM] + [distance_band(DISTANCE_BANDS_KM[-1]), NA]
+        text += _bucket_lines('distance', {band: by_band[band] for band in bands if band in by_band})
+        text += _bucket_lines('via', by_via)
+        text += _bucket_lines('parameters', by_pars)
+        sizes.sort(key=lambda size_ms: size_ms[0])  # by size only, the order of the calc. times is kept
+        by_decile, lower = {}, 0
+        for d in range(10):
+            upper = len(sizes) * (d + 1) // 10
+            while 0 < upper < len(sizes) and sizes[upper][0] == sizes[upper - 1][0]:
+                upper += 1  # equal sizes in the same decile
+            decile = sizes[lower:upper]
+            if decile:  # numbered as emitted: ties may merge deciles, the first is always D1
+                by_decile[f"D{len(by_decile) + 1} {decile[0][0]}-{decile[-1][0]} B"] = [ms for _, ms in decile]
+            lower = max(lower, upper)
+        text += _bucket_lines('response size', by_decile)
+
+        text += '\nregression per cell: ms = intercept + b * feature (distance [km], via [0/1], size [kB])'
+        for e in cells:
+            columns = dict(e['attribution'], size=[size / 1024 for size in e['attribution']['size']])
+            result = fit(columns, ['distance', 'via', 'size'])
+            label = f"{request}{'+' if e['use_parameters'] else ''}{' mix' if e.get('mix') else ''}" \
+                    f"{' replay' if e.get('replay') else ''}"
+            if result is None:
+                text += f"\n{label:14s} n/a (too few requests or no variation)"
+                continue
+            r2 = f"{result['r2']:.3f}" if result['r2'] != NA else NA
+            text += f"\n{label:14s} n={result['n']} R2={r2} " + \
+                    ' '.join(f"{name}={value:.3f}" for name, value in result['coefficients'].items())
+
+    save_file(store.fetch("test_directory"), '_attribution.txt', text)
@@ -0,0 +1,76 @@
+"""Utility functions for compression of request bodies and responses (gzip, deflate, and br if available).
+
+Per environment in configuration.ENVIRONMENTS, these optional entries set the compression:
+- "request_compression": None (default), "gzip" or "br": the request body is compressed (Content-Encoding).
+- "accept_encoding": e.g. "gzip" or "gzip, br": sent as Accept-Encoding; default: "gzip, deflate" (and "br" if the
+  brotli library is installed). Encodings that decompress() cannot decode are never sent (e.g. zstd, as otherwise
+  added by urllib3 if zstandard is installed).
+
+In compression comparison mode (parameter compression_comparison), each test cell is run twice,
+"plain" (no compression at all) and "comp" (as configured, or DEFAULT_COMPRESSION if nothing is configured).
+"""
+
+import gzip
+import zlib
+
+import configuration as config
+from utilities import object_store as store
+
+try:
+    import brotli  # optional, only needed for "br"
+except ImportError:
+    brotli = None
+
+DEFAULT_COMPRESSION = {"request_compression": "gzip", "accept_encoding": "gzip"}
+PLAIN, COMPRESSED = "plain", "comp"
+
+
+def _decodable_encodings() -> set:
+    return {'gzip', 'x-gzip', 'deflate', 'identity'} | ({'br'} if brotli is not None else set())
+
+
+def settings(env: str) -> (str, str):
+    """(request_compression, accept_encoding) for the environment, in the compression mode of the current cell;
+    accept_encoding is always given explicitly, with encodings that decompress() can decode only."""
+    env_config = config.ENVIRONMENTS[env]
+    mode = store.fetch("compression")
+    if mode == PLAIN:
+        return None, "identity"
+    if mode == COMPRESSED and "request_compression" not in env_config and "accept_encoding" not in env_config:
+        env_config = DEFAULT_COMPRESSION
+    accept_encoding = env_config.get("accept_encoding", "gzip, deflate, br")
+    accept_encoding = ', '.join([e.strip() for e in accept_encoding.split(',')
+                                 if e.split(';')[0].strip().lower() in _decodable_encodings()]) or "identity"
+    return env_config.get("request_compression"), accept_encoding
+
+
+def file_tag() -> str:
+    """'_plain' or '_comp' in compression comparison mode, to tell apart the files of the two cells; else ''."""
+    return "_" + store.fetch("compression") if store.fetch("compression") else ""
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    if encoding == 'gzip':
+        return gzip.compress(data)
+    if encoding == 'br':
+        if brotli is None:
+            raise ValueError("ERROR: request_compression 'br' needs the brotli library (pip install brotli).")
+        return brotli.compress(data)
+    raise ValueError(f"ERROR: unknown request_compression '{encoding}', use gzip or br.")
+
+
+def decompress(data: bytes, encoding: str) -> bytes:
+    """Decode data with the given Content-Encoding (possibly a comma-separated list, applied in this order)."""
+    for e in reversed([e.strip().lower() for e in (encoding or '').split(',') if e.strip()]):
+        if e in ('gzip', 'x-gzip'):
+            data = gzip.decompress(data)
+        elif e == 'deflate':
+            try:
+                data = zlib.decompress(data)
+            except zlib.error:  # raw deflate, without zlib header
+                data = zlib.decompress(data, -zlib.MAX_WBITS)
+        elif e == 'br' and brotli is not None:
+            data = brotli.decompress(data)
+        elif e != 'identity':
+            raise ValueError(f"ERROR: cannot decode Content-Encoding '{e}'.")
+    return data
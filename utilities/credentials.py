@@ -0,0 +1,140 @@
+"""A module to manage the credentials (bearer tokens) of the environments, off the timed path of the requests.
+
+An environment in configuration.ENVIRONMENTS either has a static "authBearerKey", or an "oauth2" entry
+with "url_token", "client_id", "client_secret" and "scope" (OAuth2 client credentials flow).
+
+OAuth2 tokens are fetched when the credentials are started (before any test request), and refreshed
+in a background thread before they expire, so bearer_token() never does a network call and is safe
+to call from concurrent test cells.
+Tokens are also cached in folder FOLDERS["token_cache"], so parallel processes (test runs) share them.
+"""
+
+import json
+import os
+import threading
+import time
+
+import configuration as config
+from utilities import logging_wrapper as logging
+from utilities.oauth_utils import OAuth2Helper
+
+REFRESH_MARGIN = 0.2  # refresh when less than 20 % of the token lifetime is left ...
+MIN_REFRESH_MARGIN = 60.0  # ... or less than 60 seconds, ...
+MAX_REFRESH_MARGIN = 0.5  # ... but not before half of the lifetime (short-lived tokens)
+RETRY_AFTER_FAILURE = 30.0  # seconds
+
+_providers = {}
+_lock = threading.Lock()
+_stop_event = threading.Event()
+_wake_event = threading.Event()
+_refresher = None
+
+
+class _TokenProvider:
+    """Bearer token of one environment: static, or an OAuth2 token that is refreshed before it expires."""
+
+    def __init__(self, environment: str):
+        self.environment = environment
+        env_config = config.ENVIRONMENTS[environment]
+        self.oauth2 = OAuth2Helper(**env_config["oauth2"]) if "oauth2" in env_config else None
+        self.token = None if self.oauth2 else env_config["authBearerKey"]
+        self.issued_at, self.expires_at, self.refresh_at = 0.0, float('inf'), float('inf')
+        self.rejected = False  # True after a 401 response: do not take the token from the cache again
+
+    def refresh(self):
+        if self.rejected or not self._load_from_cache():
+            self.oauth2.get_token(new_token=True)
+            self.token, self.issued_at, self.expires_at = \
+                self.oauth2.current_token['access_token'], time.time(), self.oauth2.expires_at
+            self._save_to_cache()
+            self.rejected = False
+        self.refresh_at = self.expires_at - _refresh_margin(self.expires_at - self.issued_at)
+        logging.info(f"Credentials: token for {self.environment} valid for {round(self.expires_at - time.time())} s.")
+
+    def _cache_path(self):
+        return os.path.join(config.FOLDERS["token_cache"], f"{self.environment}.json")
+
+    def _load_from_cache(self):
+        try:
+            with open(self._cache_path(), mode='r', encoding='utf-8') as file:
+                cached = json.load(file)
+        except (OSError, ValueError):
+            return False
+        if time.time() >= cached["expires_at"] - _refresh_margin(cached["expires_at"] - cached["issued_at"]):
+            return False
+        self.token, self.issued_at, self.expires_at = cached["token"], cached["issued_at"], cached["expires_at"]
+        return True
+
+    def _save_to_cache(self):
+        os.makedirs(config.FOLDERS["token_cache"], exist_ok=True)
+        temp_path = self._cache_path() + f".{os.getpid()}.tmp"
+        with open(os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), mode='w', encoding='utf-8') as f:
+            json.dump({"token": self.token, "issued_at": self.issued_at, "expires_at": self.expires_at}, f)
+        os.replace(temp_path, self._cache_path())  # atomic, other processes never see a partial file
+
+
+def _refresh_margin(lifetime: float) -> float:
+    """Seconds before expiry to refresh a token of the given lifetime; always after it is issued."""
+    return min(max(MIN_REFRESH_MARGIN, REFRESH_MARGIN * lifetime), MAX_REFRESH_MARGIN * lifetime)
+
+
+def start(environments: list):
+    """Obtain the tokens of the given environments and start the background refresh."""
+    global _refresher
+    for environment in environments:
+        _provider(environment)
+    with _lock:
+        if _refresher is None and any(p.oauth2 for p in _providers.values()):
+            _stop_event.clear()
+            _wake_event.clear()
+            _refresher = threading.Thread(target=_refresh_loop, name="credentials", daemon=True)
+            _refresher.start()
+
+
+def stop():
+    """Stop the background refresh."""
+    global _refresher
+    _stop_event.set()
+    _wake_event.set()
+    if _refresher is not None:
+        _refresher.join()
+        _refresher = None
+
+
+def bearer_token(environment: str) -> str:
+    """The current bearer token of the environment; no network call, once started."""
+    provider = _providers.get(environment)
+    return (provider if provider else _provider(environment)).token
+
+
+def refresh_soon(environment: str):
+    """Have the token of the environment refreshed by the background thread, e.g. after a 401 response."""
+    provider = _providers.get(environment)
+    if provider and provider.oauth2:
+        provider.rejected, provider.refresh_at = True, 0.0
+        _wake_event.set()
+
+
+def _provider(environment: str) -> _TokenProvider:
+    with _lock:
+        if environment not in _providers:
+            provider = _TokenProvider(environment)
+            if provider.oauth2:
+                provider.refresh()
+            _providers[environment] = provider
+        return _providers[environment]
+
+
+def _refresh_loop():
+    while True:
+        due = min([p.refresh_at for p in _providers.values() if p.oauth2], default=float('inf'))
+        _wake_event.wait(timeout=max(0.0, min(due - time.time(), 3600.0)))
+        _wake_event.clear()
+        if _stop_event.is_set():
+            return
+        for provider in [p for p in _providers.values() if p.oauth2 and p.refresh_at <= time.time()]:
+            try:
+                provider.refresh()
+            except Exception as e:
+                provider.refresh_at = time.time() + RETRY_AFTER_FAILURE
+                logging.warning(f"Credentials: token refresh for {provider.environment} failed: {str(e)}")
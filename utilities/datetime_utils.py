@@ -5,6 +5,7 @@
 import time
 from datetime import datetime, UTC
 
+from utilities import run_control
 from utilities.parameters import param
 
 
@@ -13,4 +14,12 @@ def utc_now_iso():
 
 
 def sleep_to_avoid_quota_exceeding():
-    time.sleep(param('sleep_time', float))
+    run_control.sleep(param('sleep_time', float))
+
+
+def sleep_until(t_monotonic: float):
+    """Sleep until the given time (based on time.monotonic()); return at once if it has already passed,
+    or if the run is cancelled or a deadline is reached."""
+    delay = t_monotonic - time.monotonic()
+    if delay > 0.0:
+        run_control.sleep(delay)
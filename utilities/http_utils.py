@@ -1,35 +1,156 @@
 """Utility functions for http calls.
 
+The requests are sent by sessions whose connections are registered, so that a cancellation (Ctrl-C) can abort the
+requests in flight at once (see abort_requests), instead of waiting for their read timeout.
 """
 
+import socket
+import threading
 import time
+import weakref
 
 import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
 
 import configuration as config
+from utilities import compression
+from utilities import credentials
 from utilities import object_store as store
+from utilities import run_control
+from utilities import spans
 from utilities.parameters import param_true
+from utilities.statistics_utils import TIMEOUT, CONNECTION_ERROR
+
+
+class FailedResponse:
+    """Stands in for the response of a request without a (complete) response: reason TIMEOUT (connect or read
+    timeout) or CONNECTION_ERROR (connection refused or reset, incomplete response, etc.)."""
+
+    status_code = 0
+
+    def __init__(self, reason: str, error: Exception):
+        self.reason, self.error = reason, error
+        self.content, self.headers = b'', {}
+        self.wire_bytes, self.decompress_time = 0, 0.0
+
+
+_connections = weakref.WeakSet()  # all open connections of the sessions, see new_session()
+_connections_lock = threading.Lock()
+
+
+def _shutdown(connection):
+    sock = connection.sock
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)  # a blocked connect, send or read in another thread fails at once
+        except OSError:
+            pass
+
+
+def _register(connection):
+    with _connections_lock:
+        _connections.add(connection)
+    if run_control.is_cancelled():  # connected after abort_requests()
+        _shutdown(connection)
+
+
+class _AbortableHTTPConnection(HTTPConnection):
+    def connect(self):
+        super().connect()
+        _register(self)
+
+
+class _AbortableHTTPSConnection(HTTPSConnection):
+    def connect(self):
+        super().connect()
+        _register(self)
+
+
+class _AbortableHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _AbortableHTTPConnection
+
+
+class _AbortableHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _AbortableHTTPSConnection
+
+
+class _AbortableAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {"http": _AbortableHTTPConnectionPool,
+                                                   "https": _AbortableHTTPSConnectionPool}
+
+
+def new_session() -> requests.Session:
+    """A requests session whose connections are aborted by abort_requests()."""
+    session = requests.Session()
+    session.mount('http://', _AbortableAdapter())
+    session.mount('https://', _AbortableAdapter())
+    return session
+
+
+def abort_requests():
+    """Abort the requests in flight (after run_control.cancel()): they end at once with a CONNECTION_ERROR."""
+    with _connections_lock:
+        connections = list(_connections)
+    for connection in connections:
+        _shutdown(connection)
 
 
 def http_post(env, body):
-    if param_true('use_session'):
-        if store.fetch("session") is None:
-            store.put("session", requests.Session())
-        session: requests.Session = store.fetch("session")
+    with spans.span('http'):
+        # an improvement for better performance. Credits: Diogo Ferreira, Mentz
+        if param_true('use_session'):
+            if store.fetch("session") is None:
+                store.put("session", new_session())
+            return _http_post(env, body, store.fetch("session"))
+        with new_session() as session:  # a new connection per request, as with requests.post()
+            return _http_post(env, body, session)
 
-    bearer_token = 'Bearer ' + config.ENVIRONMENTS[env]['authBearerKey']
-    service_url = config.ENVIRONMENTS[env]['apiEndpoint']
 
-    # an improvement for better performance. Credits: Diogo Ferreira, Mentz
-    request_provider = session if param_true('use_session') else requests
+def _http_post(env, body, session: requests.Session):
+    bearer_token = 'Bearer ' + credentials.bearer_token(env)
+    service_url = config.ENVIRONMENTS[env]['apiEndpoint']
 
     content_type = 'json' if body.strip().startswith('{') else 'xml'
     headers = {"Authorization": bearer_token, "Content-Type": f"application/{content_type}; charset=utf-8"}
     body_utf8 = body.encode('utf-8')
+    request_compression, accept_encoding = compression.settings(env)
+    headers["Accept-Encoding"] = accept_encoding
+    if request_compression:
+        headers["Content-Encoding"] = request_compression
+        body_utf8 = compression.compress(body_utf8, request_compression)
 
+    # the response is read "raw" (as transferred), to know the wire bytes and to decode it separately:
+    timeouts, response = run_control.timeouts(env), None
     start_timestamp = time.time()
-    response = request_provider.post(service_url, headers=headers, data=body_utf8)
+    try:
+        response = session.post(service_url, headers=headers, data=body_utf8, stream=True, timeout=timeouts)
+        wire_content = response.raw.read(decode_content=False)
+    except (requests.exceptions.Timeout, urllib3.exceptions.TimeoutError) as e:
+        calc_time = time.time() - start_timestamp
+        if response is not None:
+            response.close()
+        return FailedResponse(TIMEOUT, e), calc_time
+    except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError,
+            urllib3.exceptions.HTTPError) as e:
+        calc_time = time.time() - start_timestamp
+        if response is not None:
+            response.close()
+        return FailedResponse(CONNECTION_ERROR, e), calc_time
     end_timestamp = time.time()
     calc_time = end_timestamp - start_timestamp
 
+    start_decompress = time.perf_counter()
+    response._content = compression.decompress(wire_content, response.headers.get('Content-Encoding'))
+    response.decompress_time = time.perf_counter() - start_decompress
+    response.wire_bytes = len(wire_content)
+    response._content_consumed = True
+    response.close()  # releases the connection to the pool of the session
+    if response.status_code == 401:
+        credentials.refresh_soon(env)
+
     return response, calc_time
@@ -1,11 +1,20 @@
 """A wrapper for logging, based on the builtin logging library.
 
+Log records are put into a queue (O(1) for the caller, e.g. in the request loop) and written to the console
+and the log file by a background listener thread. The per-request lines of log1connection() are even formatted
+in the listener thread. Optionally (see configure()), only a sample of the per-request lines is written to the
+console, and all per-request data is written to a machine-readable JSON-lines file.
 """
 
+import atexit
+import json
 import logging
+import logging.handlers
 import os
+import queue
 import shutil
 import sys
+from datetime import datetime, UTC
 
 import configuration as config
 from utilities import object_store as store
@@ -21,11 +30,97 @@ if not os.path.exists(LOG_FILE):
     with open(file=LOG_FILE, mode="w") as f:
         f.write("")
 
-LOG_HANDLERS = [
-    logging.StreamHandler(sys.stdout),
-    logging.FileHandler(LOG_FILE, 'w', 'utf-8'),
-]
-logging.basicConfig(handlers=LOG_HANDLERS, level=logging.INFO, format='%(asctime)s: %(levelname)s: %(message)s')
+
+class _ConnectionMessage:
+    """The message of log1connection(); rendered only when written, i.e. in the listener thread."""
+
+    def __init__(self, fields: dict):
+        self.fields = fields
+
+    def __str__(self):
+        f = self.fields
+        message_text = "/" + f["message"] if f["message"] else ""
+        to_text = " to " + f["b"] if f["b"] and f["b"] != "n/a" else ""
+        via_text = " via " + f["via"] if f["via"] and f["via"] != "n/a" else ""
+        return (f"{f['nr']:02d} {f['env']:9s} {f['req']:11s}:{f['ms']:>5d} ms,{f['bytes']:>8d} B., "
+                f"{f['code_n_reason']}{message_text} ({f['a']}{to_text}{via_text}).")
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """Leaves per-request records as they are, to be formatted by the listener thread."""
+
+    def prepare(self, record):
+        return record if isinstance(record.msg, _ConnectionMessage) else super().prepare(record)
+
+
+class _SamplingFilter(logging.Filter):
+    """Passes all records, but only the given share (0.0 ... 1.0) of the per-request records, evenly spread."""
+
+    def __init__(self, rate: float = 1.0):
+        super().__init__()
+        self.rate, self.credit = rate, 0.0
+
+    def filter(self, record):
+        if not isinstance(record.msg, _ConnectionMessage):
+            return True
+        self.credit += self.rate
+        if self.credit >= 1.0:
+            self.credit -= 1.0
+            return True
+        return False
+
+
+class _JsonLinesFormatter(logging.Formatter):
+
+    def format(self, record):
+        fields = dict(record.msg.fields, time=datetime.fromtimestamp(record.created, UTC).isoformat())
+        return json.dumps(fields, ensure_ascii=False)
+
+
+class _ConnectionsOnlyFilter(logging.Filter):
+
+    def filter(self, record):
+        return isinstance(record.msg, _ConnectionMessage)
+
+
+LOG_FORMATTER = logging.Formatter('%(asctime)s: %(levelname)s: %(message)s')
+CONSOLE_HANDLER = logging.StreamHandler(sys.stdout)
+FILE_HANDLER = logging.FileHandler(LOG_FILE, 'w', 'utf-8')
+CONSOLE_SAMPLING = _SamplingFilter()
+for handler in (CONSOLE_HANDLER, FILE_HANDLER):
+    handler.setFormatter(LOG_FORMATTER)
+CONSOLE_HANDLER.addFilter(CONSOLE_SAMPLING)
+
+LOG_QUEUE = queue.SimpleQueue()
+_listener = logging.handlers.QueueListener(LOG_QUEUE, CONSOLE_HANDLER, FILE_HANDLER, respect_handler_level=True)
+_queue_handler = _QueueHandler(LOG_QUEUE)
+_queue_handler.setFormatter(logging.Formatter('%(message)s'))  # the listener's handlers do the final formatting
+logging.basicConfig(handlers=[_queue_handler], level=logging.INFO)
+_listener.start()
+atexit.register(_listener.stop)
+
+
+def configure(console_sample_rate: float = 1.0, json_lines_file: str = None):
+    """Write only the given share of the per-request lines to the console (the log file gets all),
+    and, if json_lines_file is given, all per-request data as JSON lines to this file."""
+    CONSOLE_SAMPLING.rate = console_sample_rate
+    handlers = [CONSOLE_HANDLER, FILE_HANDLER]
+    if json_lines_file:
+        json_handler = logging.FileHandler(json_lines_file, 'w', 'utf-8')
+        json_handler.setFormatter(_JsonLinesFormatter())
+        json_handler.addFilter(_ConnectionsOnlyFilter())
+        handlers.append(json_handler)
+    _listener.stop()
+    for handler in [h for h in _listener.handlers if h not in handlers]:
+        handler.close()
+    _listener.handlers = tuple(handlers)
+    _listener.start()
+
+
+def flush():
+    """Wait until all queued records are written."""
+    _listener.stop()
+    _listener.start()
 
 
 def warning(*args):
@@ -38,14 +133,11 @@ def info(*args):
 
 def log1connection(nr: int, env: str, req: str, a: str, b: str, via: str, ms: int, bytes: int, code_n_reason: str,
                    message=""):
-    message_text = "/" + message if message else ""
-    to_text = " to " + b if b and b != "n/a" else ""
-    via_text = " via " + via if via and via != "n/a" else ""
-    logging.info(f"{nr:02d} {env:9s} {req:11s}:{ms:>5d} ms,{bytes:>8d} B., {code_n_reason}{message_text} "
-                 f"({a}{to_text}{via_text}).")
+    logging.info(_ConnectionMessage(dict(nr=nr, env=env, req=req, a=a, b=b, via=via, ms=ms, bytes=bytes,
+                                         code_n_reason=code_n_reason, message=message)))
 
 
 def copy_log_file_to_test_directory():
+    flush()
     if os.path.exists(LOG_FILE):
         shutil.copy2(LOG_FILE, os.path.join(config.FOLDERS["output"], store.fetch("test_directory"), '_log.txt'))
-
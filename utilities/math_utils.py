@@ -2,8 +2,23 @@
 
 """
 
+import math
+import random
+
+from utilities import object_store as store
+
 
 def rnd(f: float, decimal_digits=6):
     """Round float number to the given decimal_digits."""
     return float(('{:.' + str(decimal_digits) + 'f}').format(f))
 
+
+def calc_percentile(array, percentile):
+    """Percentile (nearest rank) of the values in array."""
+    # credits: https://www.delftstack.com/howto/python/python-percentile/
+    return sorted(array)[int(math.ceil((len(array) * percentile) / 100)) - 1]
+
+
+def rng():
+    """The random number generator of the current test cell (see main.run_cell), else the module random."""
+    return store.fetch("rng") or random
@@ -0,0 +1,230 @@
+"""A local stand-in ("mock") for the OJP, TRIAS and J-S services, to test without live endpoints and API keys.
+
+Accepts the request bodies built from the templates (TR, TIR, LIR, SER of OJP 1.0 and 2.0, TRIAS 2020 TR
+and J-S trips), and returns synthetic responses of realistic size, or recorded responses (e.g. files saved by
+a former test run with save_details = True). Latency (log-normal), error rate and 429 throttling are configurable
+in configuration.MOCK_SERVER.
+
+Each response carries a header X-Mock-Server-Time with the time spent in the server [s], so the harness
+can report its own overhead (calc. time minus server time).
+
+The server is started by the harness if parameter start_mock_server = True, and may be used
+as any other environment, e.g. "MOCK" in configuration.ENVIRONMENTS.
+It may also be run on its own, configured by MOCK_SERVER only (no parameters file):
+    python -m utilities.mock_server [port]
+
+Files in folder MOCK_SERVER["files_folder"] are served by GET /files/<name>, with ETag and Last-Modified headers,
+and 304 Not Modified on a conditional request (If-None-Match, If-Modified-Since), e.g. to test the download
+of the service points file.
+"""
+
+import email.utils
+import gzip
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+from datetime import datetime, UTC
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import configuration as config
+
+SERVER_TIME_HEADER = "X-Mock-Server-Time"
+
+# root element of the request -> request type (name without version):
+_XML_REQUEST_ELEMENTS = (
+    ('OJPTripInfoRequest', 'TIR'),
+    ('OJPTripRequest', 'TR'),
+    ('OJPLocationInformationRequest', 'LIR'),
+    ('OJPStopEventRequest', 'SER'),
+)
+
+_DELIVERIES = {'TR': 'OJPTripDelivery', 'TIR': 'OJPTripInfoDelivery', 'LIR': 'OJPLocationInformationDelivery',
+               'SER': 'OJPStopEventDelivery'}
+
+
+def detect_request_type(body: str) -> str:
+    """Detect the request type of a request body, e.g. 'TR20', 'LIR10', 'TRIAS2020TR' or 'J-S-TRIPSOD'."""
+    if body.lstrip().startswith('{'):
+        return 'J-S-TRIPSOD'
+    if '<Trias' in body:
+        return 'TRIAS2020TR'
+    for element, rt in _XML_REQUEST_ELEMENTS:
+        if element in body:
+            return rt + ('10' if '<ojp:' in body else '20')
+    return None
+
+
+def synthetic_response(request_type: str, n_bytes: int) -> str:
+    """A synthetic, well-formed response for the given request type, of approximately n_bytes size
+    (repeating result elements; a TR response contains a JourneyRef and OperatingDayRef for a subsequent TIR)."""
+    now = datetime.now(UTC).isoformat()
+    if request_type == 'J-S-TRIPSOD':
+        trip = {"id": "", "legs": [{"serviceJourney": {"id": "mock-journey", "operatingDay": now[0:10],
+                                                       "stopPoints": [{"place": {"name": "mock stop"}}] * 10}}]}
+        trips = []
+        while len(trips) == 0 or len(json.dumps(trips)) < n_bytes:
+            trips.append(dict(trip, id=f"mock-trip-{len(trips) + 1}"))
+        return json.dumps({"trips": trips})
+
+    if request_type == 'TRIAS2020TR':
+        head = ('<?xml version="1.0" encoding="UTF-8"?>\n<Trias version="1.1" xmlns="http://www.vdv.de/trias" '
+                'xmlns:siri="http://www.siri.org.uk/siri"><ServiceDelivery>'
+                f'<siri:ResponseTimestamp>{now}</siri:ResponseTimestamp><DeliveryPayload><TripResponse>')
+        block = ('<TripResult><ResultId>{n}</ResultId><Trip><TripId>mock-trip-{n}</TripId><TripLeg><LegId>1</LegId>'
+                 '<TimedLeg><Service><JourneyRef>mock-journey-{n}</JourneyRef></Service></TimedLeg></TripLeg>'
+                 '</Trip></TripResult>')
+        tail = '</TripResponse></DeliveryPayload></ServiceDelivery></Trias>'
+        return _fill(head, block, tail, n_bytes)
+
+    rt, version = request_type[:-2], request_type[-2:]
+    o, s = ('ojp:', '') if version == '10' else ('', 'siri:')
+    root = ('<OJP xmlns="http://www.siri.org.uk/siri" xmlns:ojp="http://www.vdv.de/ojp" version="1.0">'
+            if version == '10' else
+            '<OJP xmlns="http://www.vdv.de/ojp" xmlns:siri="http://www.siri.org.uk/siri" version="2.0">')
+    delivery = o + _DELIVERIES[rt]
+    head = (f'<?xml version="1.0" encoding="UTF-8"?>\n{root}<{o}OJPResponse><{s}ServiceDelivery>'
+            f'<{s}ResponseTimestamp>{now}</{s}ResponseTimestamp>'
+            f'<{s}ProducerRef>ojpch-performance-test mock server</{s}ProducerRef><{delivery}>')
+    block = (f'<{o}Result><{o}Id>{{n}}</{o}Id><{o}TimedLeg><{o}Service>'
+             f'<{o}OperatingDayRef>{now[0:10]}</{o}OperatingDayRef>'
+             f'<{o}JourneyRef>mock-journey-{{n}}</{o}JourneyRef>'
+             f'<{o}LegIntermediate><{s}StopPointRef>ch:1:sloid:{{n}}</{s}StopPointRef></{o}LegIntermediate>'
+             f'</{o}Service></{o}TimedLeg></{o}Result>')
+    tail = f'</{delivery}></{s}ServiceDelivery></{o}OJPResponse></OJP>'
+    return _fill(head, block, tail, n_bytes)
+
+
+def _fill(head: str, block: str, tail: str, n_bytes: int) -> str:
+    n_blocks = max(1, math.ceil((n_bytes - len(head) - len(tail)) / len(block)))
+    return head + ''.join(block.replace('{n}', str(n + 1)) for n in range(n_blocks)) + tail
+
+
+def _load_recorded_responses(folder: str) -> dict:
+    """Load recorded response files (as saved with save_details = True), by request type."""
+    recorded = {}
+    if folder and os.path.isdir(folder):
+        for file_name in os.listdir(folder):
+            if '_response_200.' in file_name and '_prior_' not in file_name:
+                rt = file_name.split('_')[1].rstrip('+')
+                with open(os.path.join(folder, file_name), mode='rb') as file:
+                    recorded.setdefault(rt, []).append(file.read())
+    return recorded
+
+
+class MockServer(ThreadingHTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, settings: dict):
+        super().__init__((settings["host"], settings["port"]), _MockHandler)
+        self.settings = settings
+        self.recorded = _load_recorded_responses(settings.get("recorded_responses_folder"))
+        self.synthetic_cache = {}
+        self.gzip_cache = {}
+        self.counts = {"requests": 0, "errors": 0, "throttled": 0}
+        self.lock = threading.Lock()
+
+    def count(self, key: str):
+        with self.lock:
+            self.counts[key] += 1
+
+    def response_body(self, request_type: str) -> bytes:
+        if request_type in self.recorded:
+            return random.choice(self.recorded[request_type])
+        if request_type not in self.synthetic_cache:
+            kbytes = self.settings["response_kbytes"].get(request_type, self.settings["response_kbytes"]["default"])
+            self.synthetic_cache[request_type] = synthetic_response(request_type, int(1024 * kbytes)).encode('utf-8')
+        return self.synthetic_cache[request_type]
+
+    def gzipped(self, payload: bytes) -> bytes:
+        key = id(payload)  # payloads are cached, i.e. the same objects
+        if key not in self.gzip_cache:
+            self.gzip_cache[key] = gzip.compress(payload)
+        return self.gzip_cache[key]
+
+
+class _MockHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'  # keep-alive, as with the real services
+    disable_nagle_algorithm = True  # else headers and body (two writes) wait for the client's delayed ACK (~40 ms)
+
+    def do_POST(self):
+        start = time.perf_counter()
+        settings = self.server.settings
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        body = body.decode('utf-8', errors='replace')
+        self.server.count("requests")
+
+        time.sleep(random.lognormvariate(math.log(settings["latency_median_ms"] / 1000.0), settings["latency_sigma"]))
+
+        request_type, draw = detect_request_type(body), random.random()
+        if draw < settings["throttle_rate"]:
+            self.server.count("throttled")
+            self._respond(start, 429, b'Too Many Requests', 'text/plain', {"Retry-After": "1"})
+        elif draw < settings["throttle_rate"] + settings["error_rate"] or request_type is None:
+            self.server.count("errors")
+            self._respond(start, 500 if request_type else 400, b'Mock server error', 'text/plain')
+        else:
+            content_type = 'application/json' if request_type == 'J-S-TRIPSOD' else 'application/xml'
+            payload, headers = self.server.response_body(request_type), {}
+            if 'gzip' in self.headers.get('Accept-Encoding', ''):
+                payload, headers = self.server.gzipped(payload), {"Content-Encoding": "gzip"}
+            self._respond(start, 200, payload, content_type, headers)
+
+    def do_GET(self):
+        start = time.perf_counter()
+        folder, name = self.server.settings.get("files_folder"), self.path.split('?')[0][len('/files/'):]
+        path = os.path.join(folder, name) if folder and self.path.startswith('/files/') else None
+        if path is None or '/' in name or name in ('', '..') or not os.path.isfile(path):
+            self._respond(start, 404, b'Not Found', 'text/plain')
+            return
+        stat = os.stat(path)
+        etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+        last_modified = email.utils.formatdate(stat.st_mtime, usegmt=True)
+        headers = {"ETag": etag, "Last-Modified": last_modified}
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if self.headers.get('If-None-Match') == etag or (
+                'If-None-Match' not in self.headers and if_modified_since and
+                email.utils.parsedate_to_datetime(if_modified_since).timestamp() >= int(stat.st_mtime)):
+            self._respond(start, 304, b'', 'application/octet-stream', headers)
+            return
+        with open(path, mode='rb') as file:
+            self._respond(start, 200, file.read(), 'application/octet-stream', headers)
+
+    def _respond(self, start: float, status: int, payload: bytes, content_type: str, headers: dict = None):
+        try:
+            self.send_response(status)
+            self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+            self.send_header("Content-Length", str(len(payload)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.send_header(SERVER_TIME_HEADER, f"{time.perf_counter() - start:.6f}")
+            self.end_headers()
+            self.wfile.write(payload)
+        except ConnectionError:  # the client is gone, e.g. after its read timeout
+            self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass  # no logging per request; would only add to the latency.
+
+
+def start_mock_server(settings: dict = None) -> MockServer:
+    """Start the mock server in a background (daemon) thread and return it; stop it with server.shutdown()."""
+    server = MockServer(settings or config.MOCK_SERVER)
+    threading.Thread(target=server.serve_forever, name="mock_server", daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    settings = dict(config.MOCK_SERVER, port=int(sys.argv[1])) if len(sys.argv) > 1 else config.MOCK_SERVER
+    print(f"Mock server listening on http://{settings['host']}:{settings['port']}/ (Ctrl-C to stop).")
+    try:
+        MockServer(settings).serve_forever()
+    except KeyboardInterrupt:
+        pass
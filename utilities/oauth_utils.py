@@ -2,9 +2,14 @@
 OAuth2 access token from an OAuth2 authorization server,
 based on OAuth2 client credentials flow (using client id and secret).
 
+The token is cached until shortly before it expires (as given by 'expires_in' of the token response).
+The helper is thread-safe; tokens are fetched with a pooled session.
 """
 
 
+import threading
+import time
+
 import urllib3
 import json
 import requests
@@ -14,6 +19,8 @@ class OAuth2Helper:
 
     # Credits: https://developer.byu.edu/docs/consume-api/use-api/oauth-20/oauth-20-python-sample-code
 
+    DEFAULT_EXPIRES_IN = 3600  # seconds, if the token response has no 'expires_in'
+
     def __init__(self, url_token, client_id, client_secret, scope):
         urllib3.disable_warnings()
         self.url_token = url_token
@@ -21,12 +28,19 @@ class OAuth2Helper:
         self.client_id = client_id
         self.client_secret = client_secret
         self.current_token = None
-
-    def get_token(self, new_token=False):
-        if new_token or not self.current_token:
-            data = {'grant_type': 'client_credentials', 'scope': self.scope}
-            access_token_response = requests.post(self.url_token, data=data, verify=False, allow_redirects=False,
-                                                  auth=(self.client_id, self.client_secret))
-            self.current_token = json.loads(access_token_response.text)
-        return self.current_token['access_token']
-
+        self.expires_at = 0.0  # time.time() when the current token expires
+        self.session = requests.Session()
+        self.lock = threading.Lock()
+
+    def get_token(self, new_token=False, min_validity=60.0):
+        """Return the current token, fetch a new one if requested, missing, or valid for less than min_validity s."""
+        with self.lock:
+            if new_token or not self.current_token or time.time() + min_validity >= self.expires_at:
+                data = {'grant_type': 'client_credentials', 'scope': self.scope}
+                access_token_response = self.session.post(self.url_token, data=data, verify=False,
+                                                          allow_redirects=False, timeout=30,
+                                                          auth=(self.client_id, self.client_secret))
+                access_token_response.raise_for_status()
+                self.current_token = json.loads(access_token_response.text)
+                self.expires_at = time.time() + float(self.current_token.get('expires_in', self.DEFAULT_EXPIRES_IN))
+            return self.current_token['access_token']
@@ -6,16 +6,47 @@ Each module has to import this object_store and fetch/put the objects it needs.
 
 This helps for loose coupling and testability of the modules.
 
+Test cells (environment x request type) may run concurrently, each in its own thread. A cell opens a
+cell_scope(): within it, put() stores objects private to the cell (and thread), fetch() looks there first,
+then in the shared store. Shared objects (e.g. "stats") are put outside of any cell scope.
 """
 
+import threading
+from contextlib import contextmanager
+
 STORE = {}
+_LOCAL = threading.local()
 
 
 def fetch(key: str):
     """Get an object for a given key, or None."""
+    scope = getattr(_LOCAL, "scope", None)
+    if scope is not None and key in scope:
+        return scope[key]
     return STORE.get(key)
 
 
 def put(key: str, value):
-    """Put an object into the store, at the given key."""
-    STORE[key] = value
+    """Put an object into the store, at the given key (private to the current cell, if within a cell scope)."""
+    scope = getattr(_LOCAL, "scope", None)
+    if scope is not None:
+        scope[key] = value
+    else:
+        STORE[key] = value
+
+
+def current_scope() -> dict:
+    """A copy of the objects of the current cell scope (empty outside of a cell scope), e.g. to open a scope
+    with the same objects in a helper thread of the cell."""
+    return dict(getattr(_LOCAL, "scope", None) or {})
+
+
+@contextmanager
+def cell_scope(**objects):
+    """Open a scope private to the current thread, initialized with the given objects."""
+    previous = getattr(_LOCAL, "scope", None)
+    _LOCAL.scope = dict(objects)
+    try:
+        yield _LOCAL.scope
+    finally:
+        _LOCAL.scope = previous
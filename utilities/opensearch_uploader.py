@@ -21,8 +21,13 @@ def upload_stats_to_opensearch():
                 "environment": stat["environment"],
                 "request": stat["request"],
                 "use_parameters": str(stat["use_parameters"]).lower(),
+                "mixed_traffic": str(stat["mix"]).lower(),
+                "replay": str(stat["replay"]).lower(),
+                "compression": stat["compression"],
                 "ok": stat["n200"],
                 "not_ok": stat["n"] - stat["n200"],
+                "timeout": stat["ntimeout"],
+                "connection_error": stat["nconnerr"],
                 "p50": stat["ctp50"],
                 "p90": stat["ctp90"],
                 "average": stat["ctavg"]
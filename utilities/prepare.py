@@ -11,6 +11,7 @@ from datetime import datetime
 import configuration as config
 from utilities import logging_wrapper as logging
 from utilities import object_store as store
+from utilities import run_history
 from utilities import stop_points
 from utilities.parameters import param, param_true
 
@@ -32,11 +33,22 @@ def remove_old_test_directories():
     if param_true('remove_old_test_directories'):
         test_dirs = [d for d in os.listdir(config.FOLDERS["output"]) if d.startswith('test') and
                      os.path.isdir(os.path.join(config.FOLDERS["output"], d))]
+        if param_true('history_db'):  # keep the numbers of the (completed) test directories
+            n = run_history.ingest_all(store_requests=param_true('history_store_requests'))
+            logging.info(f"Ingested {n} test directories into run history {run_history.HISTORY_DB}.")
         for test_dir in test_dirs:
             shutil.rmtree(os.path.join(config.FOLDERS["output"], test_dir))
         logging.info(f"Removed old test directories {test_dirs}.")
 
 
+def ingest_run_history():
+    """Ingest the test directory of this run (only: others may be written by other processes) into the run history."""
+    if param_true('history_db'):
+        t_dir = store.fetch("test_directory")
+        if run_history.ingest_directory(t_dir, store_requests=param_true('history_store_requests')):
+            logging.info(f"Ingested test directory {t_dir} into run history {run_history.HISTORY_DB}.")
+
+
 def create_test_directory():
     parameters_file = param("parameters_file_name")
     t_dir = 'test_' + parameters_file.replace('.txt', '_') + datetime.now().strftime("%Y-%m-%d_%H.%M.%S")
@@ -48,6 +60,13 @@ def create_test_directory():
     logging.info(f"Created test directory {t_dir}.")
 
 
+def configure_logging():
+    json_lines_file = None
+    if param_true('log_json_lines'):
+        json_lines_file = os.path.join(config.FOLDERS["output"], store.fetch("test_directory"), '_requests.jsonl')
+    logging.configure(console_sample_rate=param('log_console_sample_rate', float), json_lines_file=json_lines_file)
+
+
 def load_connections_file():
     if param_true('use_connections_file'):
         conn_file_path = os.path.join(config.FOLDERS["test_parameters"], param('connections_file'))
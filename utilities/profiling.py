@@ -0,0 +1,109 @@
+"""A module to run a test with a profiler, set by parameter 'profiler':
+- none: no profiling (default).
+- cprofile: deterministic profiling with cProfile, of the main thread and of each test cell (thread);
+  the merged profile is saved as _profile.prof (for pstats, snakeviz, etc.) and _profile.txt in the test directory.
+  As of Python 3.12, only one cProfile profiler may be active at a time, so the sampling profiler is used instead.
+- sampling: a built-in sampling profiler, which records the stacks of all threads every SAMPLING_INTERVAL;
+  saved as _profile_samples.txt in the test directory, in "folded stacks" format (for flamegraph tools).
+"""
+
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+from contextlib import contextmanager
+
+import configuration as config
+from utilities import logging_wrapper as logging
+from utilities import object_store as store
+from utilities.parameters import param
+
+SAMPLING_INTERVAL = 0.005  # seconds
+
+_profiles = []
+_profiles_lock = threading.Lock()
+_samples = {}
+_stop_sampling = threading.Event()
+_sampler = None
+
+
+def _profiler():
+    profiler = param('profiler').lower()
+    return 'sampling' if profiler == 'cprofile' and sys.version_info >= (3, 12) else profiler
+
+
+def start():
+    """Start profiling (of the main thread, or of all threads by sampling)."""
+    global _sampler
+    if _profiler() != param('profiler').lower():
+        logging.warning("Profiler cprofile is not possible for concurrent test cells as of Python 3.12, "
+                        "using the sampling profiler instead.")
+    if _profiler() == 'cprofile':
+        profile = cProfile.Profile()
+        profile.enable()
+        store.put("main_profile", profile)
+    elif _profiler() == 'sampling':
+        _stop_sampling.clear()
+        _sampler = threading.Thread(target=_sample_loop, name="sampling_profiler", daemon=True)
+        _sampler.start()
+    elif _profiler() != 'none':
+        raise ValueError(f"ERROR: unknown profiler '{param('profiler')}', use none, cprofile or sampling.")
+
+
+@contextmanager
+def profiled_cell():
+    """Profile the current thread (a test cell) with cProfile, if so configured."""
+    if _profiler() != 'cprofile':
+        yield
+        return
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        with _profiles_lock:
+            _profiles.append(profile)
+
+
+def stop_and_save():
+    """Stop profiling and save the profile in the test directory."""
+    t_dir = os.path.join(config.FOLDERS["output"], store.fetch("test_directory"))
+    if _profiler() == 'cprofile':
+        main_profile = store.fetch("main_profile")
+        main_profile.disable()
+        stats = pstats.Stats(main_profile)
+        for profile in _profiles:
+            stats.add(profile)
+        stats.dump_stats(os.path.join(t_dir, '_profile.prof'))
+        text = io.StringIO()
+        pstats.Stats(os.path.join(t_dir, '_profile.prof'), stream=text).sort_stats('cumulative').print_stats(60)
+        with open(os.path.join(t_dir, '_profile.txt'), mode='w', encoding='utf-8') as file:
+            file.write(text.getvalue())
+        logging.info(f"Saved cProfile profile to {t_dir}/_profile.prof and _profile.txt.")
+    elif _profiler() == 'sampling':
+        _stop_sampling.set()
+        _sampler.join()
+        with open(os.path.join(t_dir, '_profile_samples.txt'), mode='w', encoding='utf-8') as file:
+            for stack, count in sorted(_samples.items(), key=lambda item: -item[1]):
+                file.write(f"{stack} {count}\n")
+        logging.info(f"Saved {sum(_samples.values())} profile samples to {t_dir}/_profile_samples.txt.")
+
+
+def _sample_loop():
+    own_id = threading.get_ident()
+    names = {}
+    while not _stop_sampling.wait(SAMPLING_INTERVAL):
+        names.update({t.ident: t.name for t in threading.enumerate()})
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            key = ';'.join([names.get(thread_id, str(thread_id))] + stack[::-1])
+            _samples[key] = _samples.get(key, 0) + 1
@@ -0,0 +1,114 @@
+"""Module for trace-driven replay: requests are sent following the shape of production traffic over time.
+
+The trace (parameter 'replay_file', in folder test_parameters) is a CSV file (delimiter ';') with a header, either
+- an arrival-rate profile: columns time;request_type;count[;minutes] - count requests of the request type
+  within the given minutes (default: 1) from time on, e.g. per-minute counts of a gateway, or
+- a request log: columns timestamp;request_type - one request at the given time.
+time and timestamp are times of day (HH:MM[:SS]) or ISO date-times (e.g. 2024-05-14T07:30:00), the latter also for
+traces over midnight. A "+" suffix to the request type sends it with parameters, as in 'request_types'.
+
+The trace is replayed with a time compression (parameter 'replay_time_compression', e.g. 24: 24 hours in one hour)
+and a load factor (parameter 'replay_load_factor', e.g. 0.1: every 10th request on average). Within a profile
+bucket, the arrivals are at random times (uniformly distributed, i.e. a Poisson process of the given rate).
+"""
+
+import csv
+import math
+import os
+import statistics
+from datetime import datetime, timedelta
+
+import configuration as config
+from utilities import object_store as store
+from utilities.file_utils import save_file
+from utilities.math_utils import calc_percentile
+from utilities.parameters import param
+from utilities.request_builder import request_type_w_or_wo_parameters_selector
+
+
+def _parse_time(text: str) -> datetime:
+    for time_format in ('%H:%M', '%H:%M:%S'):
+        try:
+            return datetime.strptime(text, time_format)  # on 1900-01-01
+        except ValueError:
+            pass
+    return datetime.fromisoformat(text)
+
+
+def load_trace(path: str) -> (list, datetime):
+    """Load a trace; return its buckets (start [s], duration [s], request_type, use_pars, count),
+    start relative to the begin of the trace, and the begin of the trace."""
+    with open(path, newline='', encoding='utf-8-sig') as file:
+        rows = [[v.strip() for v in row] for row in csv.reader(file, delimiter=';') if row and row[0].strip()]
+    if not rows:
+        raise ValueError(f"ERROR: replay file {path} is empty.")
+    header = [name.lower() for name in rows[0]]
+    is_profile = 'count' in header
+    time_column = 'time' if is_profile else 'timestamp'
+    if time_column not in header or 'request_type' not in header:
+        raise ValueError(f"ERROR: replay file {path} needs columns time;request_type;count[;minutes] (profile) "
+                         f"or timestamp;request_type (request log).")
+    i_time, i_rt = header.index(time_column), header.index('request_type')
+    i_count, i_minutes = header.index('count') if is_profile else None, \
+        header.index('minutes') if 'minutes' in header else None
+
+    entries = []
+    for row in rows[1:]:
+        rt, wo_w_pars = request_type_w_or_wo_parameters_selector(row[i_rt])
+        if len(wo_w_pars) != 1:
+            raise ValueError(f"ERROR in replay file: suffix '*' is not allowed in '{row[i_rt]}', use '-' or '+'.")
+        count = float(row[i_count]) if is_profile else 1.0
+        duration = 60.0 * float(row[i_minutes]) if is_profile and i_minutes is not None else \
+            60.0 if is_profile else 0.0
+        entries.append((_parse_time(row[i_time]), duration, rt, wo_w_pars[0], count))
+    if not entries:
+        raise ValueError(f"ERROR: replay file {path} has no entries.")
+    begin = min(entry[0] for entry in entries)
+    return [((t - begin).total_seconds(), duration, rt, use_pars, count) for t, duration, rt, use_pars, count
+            in entries], begin
+
+
+def schedule(buckets: list, load_factor: float, rng) -> list:
+    """Arrivals (time [s] relative to the begin of the trace, request_type, use_pars) of the buckets, in time order.
+    Counts are scaled by load_factor (rounded at random, so the expected number is exact)."""
+    arrivals = []
+    for start, duration, rt, use_pars, count in buckets:
+        scaled = count * load_factor
+        n = int(scaled) + (1 if rng.random() < scaled - int(scaled) else 0)
+        arrivals += [(start + duration * rng.random(), rt, use_pars) for _ in range(n)]
+    return sorted(arrivals, key=lambda arrival: arrival[0])
+
+
+def load_schedule(rng) -> (list, datetime):
+    """The arrivals of the replay file (see module description) and the begin of the trace."""
+    buckets, begin = load_trace(os.path.join(config.FOLDERS["test_parameters"], param('replay_file')))
+    return schedule(buckets, param('replay_load_factor', float), rng), begin
+
+
+def save_timeline(arrivals: list, rows: dict, lags: dict, begin: datetime, bucket_minutes: float,
+                  compression: float, tag: str):
+    """Save the statistics of a replay along the timeline of the trace, in buckets of bucket_minutes (trace time):
+    offered (scheduled) and sent requests, successful ones, their calc. time, and the maximal lag of the dispatch
+    behind the schedule. rows and lags are by arrival number (1, 2, ...)."""
+    bucket_s = 60.0 * bucket_minutes
+    buckets = {}
+    for nr, (t, _, _) in enumerate(arrivals, start=1):
+        buckets.setdefault(int(t // bucket_s), []).append(nr)
+
+    clock_format = '%H:%M' if begin.year == 1900 else '%Y-%m-%d %H:%M'
+    text = f'Replay timeline, trace time in buckets of {bucket_minutes:g} min, replayed {compression:g}x faster'
+    text += f"\n{'trace time':16s} {'replay [s]':>10s} {'offered':>8s} {'sent':>8s} {'ok':>8s} {'not_ok':>8s}" \
+            f" {'rate [1/s]':>10s} {'avg [ms]':>9s} {'p50 [ms]':>9s} {'p90 [ms]':>9s} {'max lag [s]':>11s}"
+    for b in range(max(buckets) + 1 if buckets else 0):
+        numbers = buckets.get(b, [])
+        sent = [rows[nr] for nr in numbers if nr in rows]
+        ct200 = [1000 * row[16] for row in sent if row[18].startswith('200')]
+        clock = begin + timedelta(seconds=b * bucket_s)
+        text += f"\n{clock.strftime(clock_format):16s} {b * bucket_s / compression:10.0f} {len(numbers):8d}" \
+                f" {len(sent):8d} {len(ct200):8d} {len(sent) - len(ct200):8d}" \
+                f" {len(numbers) * compression / bucket_s:10.2f}"
+        text += f" {statistics.mean(ct200):9.0f} {calc_percentile(ct200, 50.0):9.0f}" \
+                f" {calc_percentile(ct200, 90.0):9.0f}" if ct200 else f" {'n/a':>9s} {'n/a':>9s} {'n/a':>9s}"
+        max_lag = max([lags[nr] for nr in numbers if nr in lags], default=math.nan)
+        text += f" {max_lag:11.2f}" if not math.isnan(max_lag) else f" {'n/a':>11s}"
+    save_file(store.fetch("test_directory"), f'{store.fetch("environment")}_{tag}_timeline.txt', text)
@@ -3,16 +3,18 @@
 """
 
 import math
-import random
 from datetime import datetime, timedelta, date
 
+from utilities import compression
 from utilities import logging_wrapper as logging
 from utilities import object_store as store
 from utilities import stop_points
+from utilities import spans
+from utilities import stop_sampler
 from utilities.datetime_utils import sleep_to_avoid_quota_exceeding, utc_now_iso
 from utilities.file_utils import save_file
 from utilities.http_utils import http_post
-from utilities.math_utils import rnd
+from utilities.math_utils import rnd, rng
 from utilities.parameters import param, param_true
 from utilities.statistics_utils import NA
 from utilities.string_utils import find_xml_element
@@ -82,40 +84,43 @@ def build_request(call_number: int) -> (list, str):
         request.replace('o_y', rnd(o_coords[1]))
 
     if rt in ('TIR10', 'TIR20'):
-        # do an extra, prior call of TR to get journey-ref:
-        ojp_vers = rt[3:5]
-        prior_request = Template(f'TR{ojp_vers}_stopplaceref')
-        prior_request.replace('via', '')
-        prior_request.replace('timestamp', utc_now_iso())
-        prior_request.replace('o_didok', o_didok)
-        prior_request.replace('o_name', 'ORIGIN' if param_true('mask_location_name') else o_name)
-        prior_request.replace('d_didok', d_didok)
-        prior_request.replace('d_name', 'DESTINATION' if param_true('mask_location_name') else d_name)
-        prior_request.replace('arrdep', arrdeptime)
-        prior_request.replace('tr_number_of_results', '1')
-        prior_request.replace('tr_include_track_sections', 'false')
-        prior_request.replace('tr_include_turn_description', 'false')
-        prior_request.replace('tr_include_intermediate_stops', 'false')
-        prior_request.replace('tr_include_leg_projection', 'false')
-        prior_response, prior_calc_time = http_post(env, str(prior_request))
-        sleep_to_avoid_quota_exceeding()
-
-        prior_resp_text = prior_response.content.decode('utf-8')
-        op_day_ref = find_xml_element(prior_resp_text, '<ojp:OperatingDayRef>' if ojp_vers == "10" else '<OperatingDayRef>')
-        journey_ref = find_xml_element(prior_resp_text, '<ojp:JourneyRef>' if ojp_vers == "10" else '<JourneyRef>')
-        logging.log1connection(nr=call_number, env=env, req=f"prior TR{ojp_vers}", a=o_name, b=d_name, via="",
-                               ms=round(1000*prior_calc_time), bytes=len(prior_response.content),
-                               code_n_reason=f"{prior_response.status_code} {prior_response.reason}",
-                               message=f"op_day_ref={op_day_ref}, journey_ref={journey_ref}")
+        with spans.span('prior_tir', inclusive=True):
+            # do an extra, prior call of TR to get journey-ref:
+            ojp_vers = rt[3:5]
+            prior_request = Template(f'TR{ojp_vers}_stopplaceref')
+            prior_request.replace('via', '')
+            prior_request.replace('timestamp', utc_now_iso())
+            prior_request.replace('o_didok', o_didok)
+            prior_request.replace('o_name', 'ORIGIN' if param_true('mask_location_name') else o_name)
+            prior_request.replace('d_didok', d_didok)
+            prior_request.replace('d_name', 'DESTINATION' if param_true('mask_location_name') else d_name)
+            prior_request.replace('arrdep', arrdeptime)
+            prior_request.replace('tr_number_of_results', '1')
+            prior_request.replace('tr_include_track_sections', 'false')
+            prior_request.replace('tr_include_turn_description', 'false')
+            prior_request.replace('tr_include_intermediate_stops', 'false')
+            prior_request.replace('tr_include_leg_projection', 'false')
+            prior_response, prior_calc_time = http_post(env, str(prior_request))
+            sleep_to_avoid_quota_exceeding()
+
+            prior_resp_text = prior_response.content.decode('utf-8')
+            op_day_ref = find_xml_element(prior_resp_text, '<ojp:OperatingDayRef>' if ojp_vers == "10" else '<OperatingDayRef>')
+            journey_ref = find_xml_element(prior_resp_text, '<ojp:JourneyRef>' if ojp_vers == "10" else '<JourneyRef>')
+            logging.log1connection(nr=call_number, env=env, req=f"prior TR{ojp_vers}", a=o_name, b=d_name, via="",
+                                   ms=round(1000*prior_calc_time), bytes=len(prior_response.content),
+                                   code_n_reason=f"{prior_response.status_code} {prior_response.reason}",
+                                   message=f"op_day_ref={op_day_ref}, journey_ref={journey_ref}")
         if not (op_day_ref and journey_ref):
             logging.info('-  ... op_day_ref and/or journey_ref are invalid - repeat.')
             return result, None
 
         if param_true('save_details'):
-            save_file(store.fetch("test_directory"), f"{env}_TIR_{call_number:04d}_prior_TR_request.xml", prior_request)
-            save_file(store.fetch("test_directory"),
-                      f"{env:s}_TIR_{call_number:04d}_prior_TR_response_{prior_response.status_code}.xml",
-                      pretty_print_xml(prior_resp_text))
+            with spans.span('save_details'):
+                save_file(store.fetch("test_directory"),
+                          f"{env}_TIR{compression.file_tag()}_{call_number:04d}_prior_TR_request.xml", prior_request)
+                save_file(store.fetch("test_directory"),
+                          f"{env:s}_TIR{compression.file_tag()}_{call_number:04d}_prior_TR_response_{prior_response.status_code}.xml",
+                          pretty_print_xml(prior_resp_text))
         request.replace('journey_ref', journey_ref)
         request.replace('op_day_ref', op_day_ref)
 
@@ -125,10 +130,12 @@ def build_request(call_number: int) -> (list, str):
     apply_params_and_restrictions(request)
 
     if param_true('save_details'):
-        is_json = str(request).strip().startswith('{')
-        ending = 'json' if is_json else 'xml'
-        plus = "+" if store.fetch("use_pars") else ""
-        save_file(store.fetch("test_directory"), f"{env}_{rt}{plus}_{call_number:04d}_request.{ending}", request)
+        with spans.span('save_details'):
+            is_json = str(request).strip().startswith('{')
+            ending = 'json' if is_json else 'xml'
+            plus = "+" if store.fetch("use_pars") else ""
+            save_file(store.fetch("test_directory"),
+                      f"{env}_{rt}{plus}{compression.file_tag()}_{call_number:04d}_request.{ending}", request)
     return result, str(request)
 
 
@@ -158,9 +165,9 @@ def select_date_time_at_random() -> str:
     hours_min, hours_max = param('hours_min', int), param('hours_max', int)
     minutes_min, minutes_max = param('minutes_min', int), param('minutes_max', int)
 
-    days_ahead = random.randrange(days_ahead_min, days_ahead_max + 1)
-    hours = random.randrange(hours_min, hours_max + 1)
-    minutes = random.randrange(minutes_min, minutes_max + 1)
+    days_ahead = rng().randrange(days_ahead_min, days_ahead_max + 1)
+    hours = rng().randrange(hours_min, hours_max + 1)
+    minutes = rng().randrange(minutes_min, minutes_max + 1)
 
     date_ahead = date.today() + timedelta(days=days_ahead)
     return datetime(date_ahead.year, date_ahead.month, date_ahead.day, hours, minutes, 0).isoformat()
@@ -171,13 +178,13 @@ def add_random_offset_to_coord(coords_lon_lat: tuple, max_radius: float):
     Using an approximative formula which is ~ 1 % precise for Switzerland."""
     p = (1.0, 1.0)
     while math.sqrt(p[0] * p[0] + p[1] * p[1]) >= 1.0:  # find a random point within a circle of radius 1.0:
-        p = (2.0 * random.random() - 1.0, 2.0 * random.random() - 1.0)
+        p = (2.0 * rng().random() - 1.0, 2.0 * rng().random() - 1.0)
     return (coords_lon_lat[0] + max_radius * 0.01314 * p[0], coords_lon_lat[1] + max_radius * 0.00900 * p[1])
 
 
 def select_stop_point(role: str, call_number: int) -> (str, int, tuple):
-    """Select a stop point (name, number, coords) either randomly from the given stop points dict sp_dict,
-    or from a connections file."""
+    """Select a stop point (name, number, coords) either randomly from the given stop points dict sp_dict
+    (uniformly or weighted, see stop_sampler), or from a connections file."""
     if param_true('use_connections_file'):
         connections = store.fetch("connections")
         conn = connections[(call_number - 1) % len(connections)]  # if call_number exceeds # connections, cycle around
@@ -193,8 +200,7 @@ def select_stop_point(role: str, call_number: int) -> (str, int, tuple):
                 return sp.name, sp.number, (sp.lon, sp.lat)
         return NA, NA, (0.0, 0.0)
     else:
-        keys = stop_points.keys()
-        sp = stop_points.get_by_name(keys[random.randrange(0, len(keys))])
+        sp = stop_points.get_by_name(stop_sampler.draw_stop_name())
         sp_coords = [sp.lon, sp.lat]
         if param_true('use_geopos'):
             sp_coords = add_random_offset_to_coord(sp_coords, param('max_dist_from_stop', float))
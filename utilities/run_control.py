@@ -0,0 +1,78 @@
+"""A module to bound a test run in time: http timeouts, deadlines per test cell and per run, and cancellation
+(e.g. by Ctrl-C).
+
+- Timeouts (connect, read) in seconds are given by the parameters connect_timeout and read_timeout, or per
+  environment by "timeouts": (connect, read) in configuration.ENVIRONMENTS.
+- Deadlines: parameters cell_deadline and run_deadline, in seconds (0 = no deadline).
+- After a deadline or a cancellation, the test cells stop sending requests; all sleeps return at once.
+  Requests in flight end at the latest after their (read) timeout, which is capped at the remaining deadline;
+  on a cancellation, they are aborted at once (see http_utils.abort_requests).
+"""
+
+import threading
+import time
+
+import configuration as config
+from utilities import logging_wrapper as logging
+from utilities import object_store as store
+from utilities.parameters import param
+
+MIN_TIMEOUT = 0.1  # seconds, even if the deadline is (almost) reached
+
+_cancelled = threading.Event()
+_run_deadline = None
+
+
+def _deadline(seconds: float):
+    return time.monotonic() + seconds if seconds > 0.0 else None
+
+
+def start_run():
+    global _run_deadline
+    _cancelled.clear()
+    _run_deadline = _deadline(param('run_deadline', float))
+
+
+def start_cell():
+    store.put("cell_deadline", _deadline(param('cell_deadline', float)))
+
+
+def cancel(reason: str):
+    """Cancel the test run: no more requests are sent, sleeps return at once."""
+    if not _cancelled.is_set():
+        logging.warning(f"Test run cancelled ({reason}), partial results will be saved.")
+    _cancelled.set()
+
+
+def is_cancelled() -> bool:
+    return _cancelled.is_set()
+
+
+def remaining() -> float:
+    """Seconds until the earliest deadline (of the run or the current cell), or None if there is no deadline."""
+    deadlines = [d for d in (_run_deadline, store.fetch("cell_deadline")) if d is not None]
+    return min(deadlines) - time.monotonic() if deadlines else None
+
+
+def should_stop() -> bool:
+    """True if the run is cancelled or a deadline is reached."""
+    left = remaining()
+    return _cancelled.is_set() or (left is not None and left <= 0.0)
+
+
+def stop_reason() -> str:
+    return "cancelled" if _cancelled.is_set() else "deadline reached"
+
+
+def sleep(seconds: float):
+    """Sleep for the given time, but return at once on cancellation, or when a deadline is reached."""
+    left = remaining()
+    _cancelled.wait(max(0.0, min(seconds, left) if left is not None else seconds))
+
+
+def timeouts(env: str) -> (float, float):
+    """(connect, read) timeouts for the environment, the read timeout capped at the remaining deadline."""
+    connect, read = config.ENVIRONMENTS[env].get("timeouts",
+                                                 (param('connect_timeout', float), param('read_timeout', float)))
+    left = remaining()
+    return connect, max(MIN_TIMEOUT, min(read, left)) if left is not None else read
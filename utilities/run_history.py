@@ -0,0 +1,237 @@
+"""A module for a history of test runs in a local SQLite database, for fast trend queries across test runs.
+
+Each test directory (in folder "output") is ingested once, from its results tables (CSV files):
+- runs: test directory, start time, parameters.
+- cells: aggregates per environment, request type, wo/w parameters, traffic mix / trace replay / compression mode:
+  counts and calc. times (min, average, p50, p90, p95, max) [ms].
+- requests (optional): calc. time, response size and return code of each request (with the same dimensions).
+So historical analysis does not need to re-parse the CSV files, and old test directories may be removed
+(see remove_old_test_directories) without losing the numbers.
+
+Query examples on the command line (see --help), which need no parameters file and print to the console:
+    python -m utilities.run_history ingest
+    python -m utilities.run_history percentile --env OJP20PROD --request TR20 --p 90 --days 30
+    python -m utilities.run_history trend --env OJP20PROD --request TR20 --days 30
+"""
+
+import argparse
+import csv
+import json
+import os
+import sqlite3
+import statistics
+from datetime import datetime, timedelta
+
+import configuration as config
+from utilities.math_utils import calc_percentile
+
+HISTORY_DB = os.path.join(config.FOLDERS["output"], 'run_history.sqlite')
+TEST_DIR_TIME_FORMAT = "%Y-%m-%d_%H.%M.%S"  # suffix of test directory names, see prepare.create_test_directory()
+STATISTICS_FILE = '_statistics.txt'  # written when a run completes, see statistics_utils.save_statistics()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY, test_directory TEXT UNIQUE NOT NULL, started TEXT, parameters TEXT);
+CREATE TABLE IF NOT EXISTS cells (
+    run_id INTEGER NOT NULL REFERENCES runs(run_id), environment TEXT, request TEXT, use_parameters INTEGER,
+    mix INTEGER, compression TEXT, started TEXT, n INTEGER, n200 INTEGER,
+    ctmin REAL, ctavg REAL, ctp50 REAL, ctp90 REAL, ctp95 REAL, ctmax REAL, replay INTEGER DEFAULT 0);
+CREATE TABLE IF NOT EXISTS requests (
+    run_id INTEGER NOT NULL REFERENCES runs(run_id), environment TEXT, request TEXT, use_parameters INTEGER,
+    started TEXT, nr INTEGER, calc_time REAL, response_size INTEGER, return_code TEXT, ok INTEGER,
+    mix INTEGER DEFAULT 0, compression TEXT, replay INTEGER DEFAULT 0);
+CREATE INDEX IF NOT EXISTS runs_started ON runs(started);
+CREATE INDEX IF NOT EXISTS cells_env_request_started ON cells(environment, request, started);
+CREATE INDEX IF NOT EXISTS requests_env_request_started ON requests(environment, request, started, ok);
+"""
+
+
+# columns added to databases of former versions:
+MIGRATIONS = (("cells", "replay", "INTEGER DEFAULT 0"), ("requests", "mix", "INTEGER DEFAULT 0"),
+              ("requests", "compression", "TEXT"), ("requests", "replay", "INTEGER DEFAULT 0"))
+
+
+def connect(db_path: str = HISTORY_DB) -> sqlite3.Connection:
+    conn = sqlite3.connect(db_path)
+    conn.executescript(SCHEMA)
+    for table, column, column_type in MIGRATIONS:
+        if column not in [info[1] for info in conn.execute(f"PRAGMA table_info({table})")]:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+    return conn
+
+
+def ingest_directory(test_directory: str, store_requests: bool = True, db_path: str = HISTORY_DB) -> bool:
+    """Ingest a test directory (name, within folder "output"), unless already done; return True if ingested."""
+    t_path = os.path.join(config.FOLDERS["output"], test_directory)
+    conn = connect(db_path)
+    try:
+        if conn.execute("SELECT 1 FROM runs WHERE test_directory = ?", (test_directory,)).fetchone():
+            return False
+        started = _started(test_directory)
+        with conn:  # one transaction per run
+            run_id = conn.execute("INSERT INTO runs (test_directory, started, parameters) VALUES (?, ?, ?)",
+                                  (test_directory, started, json.dumps(_parameters(t_path)))).lastrowid
+            for file_name in sorted(f for f in os.listdir(t_path) if f.endswith('_results_table.csv')):
+                _ingest_results_table(conn, run_id, started, os.path.join(t_path, file_name), store_requests)
+        return True
+    finally:
+        conn.close()
+
+
+def ingest_all(store_requests: bool = True, db_path: str = HISTORY_DB) -> int:
+    """Ingest all completed test directories in folder "output" that are not yet ingested; return their number.
+    Directories without a statistics file are skipped: the run is still going on (e.g. in another process)."""
+    out = config.FOLDERS["output"]
+    test_dirs = sorted(d for d in os.listdir(out) if d.startswith('test') and os.path.isdir(os.path.join(out, d))
+                       and os.path.exists(os.path.join(out, d, STATISTICS_FILE)))
+    return sum(ingest_directory(d, store_requests, db_path) for d in test_dirs)
+
+
+def _started(test_directory: str) -> str:
+    try:
+        return datetime.strptime(test_directory[-19:], TEST_DIR_TIME_FORMAT).isoformat()
+    except ValueError:
+        return datetime.fromtimestamp(os.path.getmtime(os.path.join(config.FOLDERS["output"], test_directory))) \
+            .isoformat(timespec='seconds')
+
+
+def _parameters(t_path: str) -> dict:
+    """The parameters of the run, from the copy of the parameters file (if saved with save_details)."""
+    for file_name in [f for f in os.listdir(t_path) if f.startswith('_') and f.endswith('.txt')]:
+        parameters = {}
+        with open(os.path.join(t_path, file_name), encoding='utf-8') as file:
+            for line in [l.strip() for l in file.readlines() if not l.strip().startswith('#') and '=' in l]:
+                key, value = line.split('=')[0].strip(), line.split('=')[1].strip()
+                if key and value:
+                    parameters[key] = value
+        if 'number_of_requests' in parameters:
+            return parameters
+    return {}
+
+
+def _ingest_results_table(conn, run_id: int, started: str, path: str, store_requests: bool):
+    # file name: <environment>_<request type>[+][_plain|_comp]_results_table.csv, or <environment>_mix[...]...
+    # or <environment>_replay[...]...
+    tag = os.path.basename(path)[:-len('_results_table.csv')]
+    compression = next((c for c in ('plain', 'comp') if tag.endswith('_' + c)), None)
+    base_tag = tag[:-len(compression) - 1] if compression else tag
+    is_mix, is_replay = int(base_tag.endswith('_mix')), int(base_tag.endswith('_replay'))
+    with open(path, newline='', encoding='utf-8') as file:
+        rows = list(csv.DictReader(file, delimiter=';'))
+
+    cells = {}
+    for row in rows:
+        # column use_parameters in the results tables of newer versions, else from the file name:
+        use_parameters = int(row["use_parameters"] == 'True') if row.get("use_parameters") else \
+            int(not is_mix and not is_replay and '+' in base_tag)
+        cells.setdefault((row["environment"], row["request_type"], use_parameters), []).append(row)
+
+    for (environment, request, use_parameters), cell_rows in cells.items():
+        ct200 = [1000 * float(r["calc_time"]) for r in cell_rows if r["return_code"].startswith('200')]
+        aggregates = [None] * 6
+        if ct200:
+            aggregates = [min(ct200), statistics.mean(ct200), calc_percentile(ct200, 50.0),
+                          calc_percentile(ct200, 90.0), calc_percentile(ct200, 95.0), max(ct200)]
+        conn.execute("INSERT INTO cells (run_id, environment, request, use_parameters, mix, compression, started, "
+                     "n, n200, ctmin, ctavg, ctp50, ctp90, ctp95, ctmax, replay) "
+                     "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                     [run_id, environment, request, use_parameters, is_mix, compression, started,
+                      len(cell_rows), len(ct200)] + aggregates + [is_replay])
+        if store_requests:
+            conn.executemany("INSERT INTO requests (run_id, environment, request, use_parameters, started, nr, "
+                             "calc_time, response_size, return_code, ok, mix, compression, replay) "
+                             "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                             [(run_id, environment, request, use_parameters, started, int(r["nr"]),
+                               float(r["calc_time"]), int(r["response_size"]), r["return_code"],
+                               int(r["return_code"].startswith('200')), is_mix, compression, is_replay)
+                              for r in cell_rows])
+
+
+def _mode_filter(use_parameters: bool, mix: bool, replay: bool, compression: str) -> (str, list):
+    """SQL condition (and its arguments) on the test mode: wo/w parameters, traffic mix, trace replay and compression
+    mode (None: a run without compression comparison, else 'plain' or 'comp')."""
+    return " AND use_parameters = ? AND mix = ? AND replay = ? AND compression IS ?", \
+        [int(use_parameters), int(mix), int(replay), compression]
+
+
+def percentile(environment: str, request: str, p: float, days: int, use_parameters: bool = False,
+               mix: bool = False, replay: bool = False, compression: str = None,
+               db_path: str = HISTORY_DB) -> (float, int, str):
+    """The p-th percentile of the calc. time [ms] of successful requests over the last days, of the given test mode
+    (see _mode_filter); returns (value, number of requests, basis). Basis is 'requests', or 'cells' (mean of the
+    cells' p90/p95/p50, weighted by count) if no requests are stored."""
+    since = (datetime.now() - timedelta(days=days)).isoformat()
+    mode_condition, mode_args = _mode_filter(use_parameters, mix, replay, compression)
+    conn = connect(db_path)
+    try:
+        times = [1000 * r[0] for r in conn.execute(
+            "SELECT calc_time FROM requests WHERE environment = ? AND request = ? AND started >= ? AND ok = 1"
+            + mode_condition, [environment, request, since] + mode_args)]
+        if times:
+            return calc_percentile(times, p), len(times), 'requests'
+        column = {50.0: 'ctp50', 90.0: 'ctp90', 95.0: 'ctp95'}.get(float(p))
+        if column is None:
+            return None, 0, 'cells'
+        cells = conn.execute(f"SELECT {column}, n200 FROM cells WHERE environment = ? AND request = ? AND "
+                             "started >= ? AND n200 > 0" + mode_condition,
+                             [environment, request, since] + mode_args).fetchall()
+        n = sum(c[1] for c in cells)
+        return (sum(c[0] * c[1] for c in cells) / n if n else None), n, 'cells'
+    finally:
+        conn.close()
+
+
+def trend(environment: str, request: str, days: int, use_parameters: bool = False, mix: bool = False,
+          replay: bool = False, compression: str = None, db_path: str = HISTORY_DB) -> list:
+    """Aggregates of the cells of the given environment, request type and test mode (see _mode_filter)
+    over the last days, by start time."""
+    since = (datetime.now() - timedelta(days=days)).isoformat()
+    mode_condition, mode_args = _mode_filter(use_parameters, mix, replay, compression)
+    conn = connect(db_path)
+    try:
+        return conn.execute("SELECT started, use_parameters, mix, replay, compression, n, n200, ctavg, ctp50, ctp90, "
+                            "ctp95 FROM cells WHERE environment = ? AND request = ? AND started >= ?" + mode_condition
+                            + " ORDER BY started", [environment, request, since] + mode_args).fetchall()
+    finally:
+        conn.close()
+
+
+def _main():
+    parser = argparse.ArgumentParser(description="History of test runs (SQLite database " + HISTORY_DB + ").")
+    commands = parser.add_subparsers(dest="command", required=True)
+    ingest_parser = commands.add_parser("ingest", help="ingest all new test directories")
+    ingest_parser.add_argument("--no-requests", action="store_true", help="store cell aggregates only")
+    for name, help_text in (("percentile", "percentile of the calc. time [ms]"), ("trend", "cell aggregates by run")):
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument("--env", required=True, help="environment, e.g. OJP20PROD")
+        command.add_argument("--request", required=True, help="request type, e.g. TR20")
+        command.add_argument("--days", type=int, default=30, help="last n days (default: 30)")
+        if name == "percentile":
+            command.add_argument("--p", type=float, default=90.0, help="percentile (default: 90)")
+        command.add_argument("--with-parameters", action="store_true", help="requests with parameters")
+        command.add_argument("--mix", action="store_true", help="requests of a traffic mix")
+        command.add_argument("--replay", action="store_true", help="requests of a trace replay")
+        command.add_argument("--compression", choices=("plain", "comp"),
+                             help="requests of a compression comparison, plain or compressed")
+    args = parser.parse_args()
+
+    if args.command == "ingest":
+        print(f"Ingested {ingest_all(store_requests=not args.no_requests)} new completed test directories "
+              f"into {HISTORY_DB}.")
+        return
+    mode = dict(use_parameters=args.with_parameters, mix=args.mix, replay=args.replay, compression=args.compression)
+    if args.command == "percentile":
+        value, n, basis = percentile(args.env, args.request, args.p, args.days, **mode)
+        value_text = f"{value:.0f} ms" if value is not None else "n/a"
+        print(f"p{args.p:g} of {args.request} on {args.env}, last {args.days} days: {value_text} ({n} requests, "
+              f"based on {basis}).")
+    else:
+        print("started              pars mix replay compression      n   n200    avg    p50    p90    p95 [ms]")
+        for started, use_pars, mix, replay, comp, n, n200, ctavg, ctp50, ctp90, ctp95 in trend(
+                args.env, args.request, args.days, **mode):
+            values = ''.join(f" {v:6.0f}" if v is not None else "    n/a" for v in (ctavg, ctp50, ctp90, ctp95))
+            print(f"{started:20s} {use_pars:4d} {mix:3d} {replay:6d} {comp or '-':11s} {n:6d} {n200:6d}{values}")
+
+
+if __name__ == '__main__':
+    _main()
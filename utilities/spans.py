@@ -0,0 +1,60 @@
+"""A module for light-weight instrumentation of the phases of a test request, based on time.perf_counter_ns().
+
+Phases (PHASES) are measured with "with span('build'): ...". Spans may be nested, the time of a nested span
+is accounted to the nested phase only (exclusive times). Within an "inclusive" span (e.g. 'prior_tir',
+which itself builds a request, calls http and sleeps), nested spans are accounted to the inclusive one.
+
+Times are kept per request (start_request() ... end_request()) and per test cell (start_cell()),
+in the (cell scope of the) object store.
+"""
+
+import time
+from contextlib import contextmanager
+
+from utilities import object_store as store
+
+# per request phases (in this order in the results table), plus 'sleep' (between requests, per cell only):
+PHASES = ('build', 'prior_tir', 'http', 'validate', 'save_details', 'log')
+CELL_PHASES = PHASES + ('sleep',)
+
+
+def start_cell():
+    store.put("phase_totals", dict.fromkeys(CELL_PHASES, 0))
+    store.put("phase_stack", [])
+
+
+def start_request():
+    store.put("phases", dict.fromkeys(PHASES, 0))
+
+
+def end_request() -> list:
+    """End the measurement of the current request; return its phase times [ms], in order of PHASES."""
+    phases = store.fetch("phases")
+    store.put("phases", None)
+    return [round(phases[p] / 1e6, 3) for p in PHASES]
+
+
+@contextmanager
+def span(phase: str, inclusive: bool = False):
+    stack = store.fetch("phase_stack")
+    if stack is None or any(entry[2] for entry in stack):
+        yield  # not measuring, or within an inclusive span
+        return
+    entry = [phase, time.perf_counter_ns(), inclusive, 0]  # phase, start, inclusive, time of nested spans
+    stack.append(entry)
+    try:
+        yield
+    finally:
+        stack.pop()
+        elapsed = time.perf_counter_ns() - entry[1]
+        if stack:
+            stack[-1][3] += elapsed
+        _add(phase, elapsed - entry[3])
+
+
+def _add(phase: str, ns: int):
+    phases, totals = store.fetch("phases"), store.fetch("phase_totals")
+    if phases is not None and phase in phases:
+        phases[phase] += ns
+    if totals is not None:
+        totals[phase] += ns
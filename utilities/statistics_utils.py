@@ -1,24 +1,29 @@
 
 import csv
-import math
 import os
 import statistics
 
 import configuration as config
+from utilities import attribution
+from utilities import compression
 from utilities import logging_wrapper as logging
 from utilities import object_store as store
+from utilities import spans
 from utilities.datetime_utils import utc_now_iso
 from utilities.file_utils import save_file
+from utilities.math_utils import calc_percentile
+from utilities.parameters import param_true
 
 NA = 'n/a'
+TIMEOUT = 'TIMEOUT'  # return code of requests that timed out
+CONNECTION_ERROR = 'CONNECTION_ERROR'  # return code of requests with a failed connection or incomplete response
 RESULTS_TABLE_HEADERS = ["nr", "environment", "request_type", "origin_name", "origin_didok", "origin_lon",
                          "origin_lat", "dest_name", "dest_didok", "dest_lon", "dest_lat", "via_name", "via_didok",
-                         "via_lon", "via_lat", "arrdeptime", "calc_time", "response_size", "return_code"]
-
-
-def _calc_percentile(array, percentile):
-    # credits: https://www.delftstack.com/howto/python/python-percentile/
-    return sorted(array)[int(math.ceil((len(array) * percentile) / 100)) - 1]
+                         "via_lon", "via_lat", "arrdeptime", "calc_time", "response_size", "return_code",
+                         "server_time"] + ["t_" + phase for phase in spans.PHASES] + \
+                        ["wire_bytes", "decompress_time", "use_parameters"]
+RESULTS_PHASES_COLUMN = 20
+RESULTS_WIRE_BYTES_COLUMN = RESULTS_PHASES_COLUMN + len(spans.PHASES)
 
 
 def new_results_table():
@@ -29,42 +34,105 @@ def compute_statistics():
     n = len(store.fetch("results_table")) - 1
     ct200 = [row[16] for row in store.fetch("results_table") if row[18].startswith('200')]
     n200 = len(ct200)
+    ntimeout = len([row for row in store.fetch("results_table")[1:] if row[18] == TIMEOUT])
+    nconnerr = len([row for row in store.fetch("results_table")[1:] if row[18] == CONNECTION_ERROR])
     ctmin, ctmax, ctavg, ctp50, ctp90, ctp95 = NA, NA, NA, NA, NA, NA
     if n200 > 0:
         ctavg = round(1000 * statistics.mean(ct200))
         ctmin = round(1000 * min(ct200))
         ctmax = round(1000 * max(ct200))
-        ctp50 = round(1000 * _calc_percentile(ct200, 50.0))
-        ctp90 = round(1000 * _calc_percentile(ct200, 90.0))
-        ctp95 = round(1000 * _calc_percentile(ct200, 95.0))
+        ctp50 = round(1000 * calc_percentile(ct200, 50.0))
+        ctp90 = round(1000 * calc_percentile(ct200, 90.0))
+        ctp95 = round(1000 * calc_percentile(ct200, 95.0))
+
+    # harness overhead, if the server reports its own time (e.g. the mock server):
+    oh200 = [row[16] - row[19] for row in store.fetch("results_table")[1:] if row[18].startswith('200') and
+             row[19] != NA]
+    ohavg, ohp50, ohp90 = NA, NA, NA
+    if oh200:
+        ohavg = round(1000 * statistics.mean(oh200), 1)
+        ohp50 = round(1000 * calc_percentile(oh200, 50.0), 1)
+        ohp90 = round(1000 * calc_percentile(oh200, 90.0), 1)
+
+    # harness phases, average per request [ms]; 'sleep' from the totals of the cell (not for a traffic mix/replay):
+    rows = store.fetch("results_table")[1:]
+    phases = {phase: round(statistics.mean([row[RESULTS_PHASES_COLUMN + i] for row in rows]), 3) if rows else NA
+              for i, phase in enumerate(spans.PHASES)}
+    totals = store.fetch("phase_totals")
+    phases['sleep'] = round(totals['sleep'] / 1e6 / n, 3) if totals and n > 0 and not store.fetch("mix") \
+        and not store.fetch("replay") else NA
+
+    # transfer: response size (decoded) and wire bytes (as transferred, maybe compressed), average per successful
+    # request (short error responses would skew the compression ratio):
+    size_avg, wire_avg, decompress_avg = NA, NA, NA
+    rows200 = [row for row in rows if row[18].startswith('200')]
+    if rows200:
+        size_avg = round(statistics.mean([row[17] for row in rows200]))
+        wire_avg = round(statistics.mean([row[RESULTS_WIRE_BYTES_COLUMN] for row in rows200]))
+        decompress_avg = round(1000 * statistics.mean([row[RESULTS_WIRE_BYTES_COLUMN + 1] for row in rows200]), 3)
 
     stat = {'timestamp': utc_now_iso(),
             'use_parameters': store.fetch("use_pars"),
             'environment': store.fetch("environment"), 'request': store.fetch("request_type"),
-            'n200': n200, 'n': n, 'ctavg': ctavg, 'ctmin': ctmin, 'ctmax': ctmax,
-            'ctp50': ctp50, 'ctp90': ctp90, 'ctp95': ctp95}
+            'mix': bool(store.fetch("mix")), 'replay': bool(store.fetch("replay")), 'cell': store.fetch("cell"), 'compression': store.fetch("compression"),
+            'n200': n200, 'n': n, 'ntimeout': ntimeout, 'nconnerr': nconnerr, 'ctavg': ctavg, 'ctmin': ctmin, 'ctmax': ctmax,
+            'ctp50': ctp50, 'ctp90': ctp90, 'ctp95': ctp95,
+            'ohavg': ohavg, 'ohp50': ohp50, 'ohp90': ohp90, 'phases': phases,
+            'size_avg': size_avg, 'wire_avg': wire_avg, 'decompress_avg': decompress_avg,
+            'attribution': attribution.features(store.fetch("results_table")) if param_true('latency_attribution')
+            else None}
 
     store.fetch("stats").append(stat)
 
 
 def save_statistics():
     stat = 'Test Statistics'
-    stat += '\nService                                      number of tests                                                   calc. time [ms]'
-    stat += '\nenvironment  request type        total         ok     not_ok        min    average        p50        p90        p95        max'
+    stat += '\nService                                      number of tests                                                                         calc. time [ms]'
+    stat += '\nenvironment  request type        total         ok     not_ok    timeout   conn_err        min    average        p50        p90        p95        max'
     for e in store.fetch("stats"):
-        rt_plus = e['request'] + ("+" if e['use_parameters'] else "")
-        stat += f"\n{e['environment']:12s} {rt_plus:14s} {e['n']:10d} {e['n200']:10d} {e['n'] - e['n200']:10d}"
+        stat += f"\n{e['environment']:12s} {_cell_label(e):14s} {e['n']:10d} {e['n200']:10d} {e['n'] - e['n200']:10d} {e['ntimeout']:10d} {e['nconnerr']:10d}"
         stat += f" {e['ctmin']:10d} {e['ctavg']:10d} {e['ctp50']:10d} {e['ctp90']:10d} {e['ctp95']:10d} {e['ctmax']:10d}" if \
             e['n200'] > 0 else '        n/a        n/a        n/a        n/a        n/a        n/a'
 
+    overheads = [e for e in store.fetch("stats") if e['ohavg'] != NA]
+    if overheads:
+        stat += '\n\nHarness overhead (calc. time - server time) [ms]'
+        stat += '\nenvironment  request type      average        p50        p90'
+        for e in overheads:
+            stat += f"\n{e['environment']:12s} {_cell_label(e):14s} {e['ohavg']:10.1f} {e['ohp50']:10.1f} {e['ohp90']:10.1f}"
+
+    stat += '\n\nHarness phases, average per request [ms]'
+    stat += '\nenvironment  request type   ' + ''.join(f"{phase:>13s}" for phase in spans.CELL_PHASES)
+    for e in store.fetch("stats"):
+        stat += f"\n{e['environment']:12s} {_cell_label(e):14s}"
+        stat += ''.join(f"{e['phases'][phase]:13.3f}" if e['phases'][phase] != NA else f"{NA:>13s}"
+                        for phase in spans.CELL_PHASES)
+
+    stat += '\n\nTransfer, average per successful request'
+    stat += '\nenvironment  request type    size [B]   wire [B]  wire/size  decompress [ms]'
+    for e in store.fetch("stats"):
+        stat += f"\n{e['environment']:12s} {_cell_label(e):14s}"
+        stat += f" {e['size_avg']:10d} {e['wire_avg']:10d} {e['wire_avg'] / max(e['size_avg'], 1):10.3f}" \
+                f" {e['decompress_avg']:15.3f}" if e['size_avg'] != NA else '        n/a        n/a        n/a             n/a'
+
     logging.info('STATISTICS:\n' + stat)
     save_file(store.fetch("test_directory"), '_statistics.txt', stat)
     save_file(None, 'latest_statistics.txt', stat)
 
 
-def save_results_table_csv_file():
+def _cell_label(e):
+    """Label of a test cell in the statistics, e.g. 'TR20+' (with parameters), 'TR20 mix' (from a traffic mix),
+    'TR20 replay' (from a trace replay) or 'TR20 comp' (compressed, in compression comparison mode)."""
+    return e['request'] + ("+" if e['use_parameters'] else "") + (" mix" if e.get('mix') else "") + \
+        (" replay" if e.get('replay') else "") + \
+        (" " + e['compression'] if e.get('compression') else "")
+
+
+def save_results_table_csv_file(tag: str = None):
     env, rt = store.fetch("environment"), store.fetch("request_type")
-    path = os.path.join(config.FOLDERS["output"], store.fetch("test_directory"), env + "_" + rt + "_results_table.csv")
+    tag = tag if tag else rt + ("+" if store.fetch("use_pars") else "")
+    tag += compression.file_tag()
+    path = os.path.join(config.FOLDERS["output"], store.fetch("test_directory"), env + "_" + tag + "_results_table.csv")
     with open(file=path, mode="w", newline="", encoding='utf-8') as file:
         writer = csv.writer(file, delimiter=";")
         for row in store.fetch("results_table"):
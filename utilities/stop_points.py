@@ -2,85 +2,175 @@
 Loads the data to folder "stop_points".
 
 This is a replacement for the old, decommissioned DIDOK data.
+
+The service points ZIP file is downloaded (streamed to disk) from config.SP_PERMALINK, and refreshed when older
+than config.SP_MAX_AGE_DAYS: conditionally (ETag / If-Modified-Since, kept in SP_METADATA_FILE), i.e. only
+downloaded again if changed. The CSV is read directly from the ZIP file, without unpacking it.
+If the download fails or is not a ZIP file with a CSV, an existing ZIP file, or a CSV file of an older version, is used.
 """
+import csv
+import io
+import json
 import os
+import time
+import zipfile
+from contextlib import contextmanager
+
 import requests
-import shutil
-import csv
+
 import configuration as config
 from utilities import logging_wrapper as logging
 
+SP_ZIP_FILE = 'service_points.zip'
+SP_METADATA_FILE = 'service_points.json'
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024  # bytes
 
 sp_dict = {}
 sp_columns = None
-keys = None
+_keys = []
 
 
 def keys():
-    return keys
+    return _keys
 
 
 def get_by_name(name: str):
     return sp_dict.get(name)
 
 
+def _load_metadata(sp_dir: str) -> dict:
+    path = os.path.join(sp_dir, SP_METADATA_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as file:
+        return json.load(file)
+
+
+def _save_metadata(sp_dir: str, metadata: dict):
+    with open(os.path.join(sp_dir, SP_METADATA_FILE), mode='w', encoding='utf-8') as file:
+        json.dump(metadata, file, indent=2)
+
+
+def _refresh_zip(sp_dir: str):
+    """Download the service points ZIP file if missing or older than SP_MAX_AGE_DAYS, and changed
+    (conditional request); streamed to a temporary file, which replaces the ZIP file when complete."""
+    zip_path = os.path.join(sp_dir, SP_ZIP_FILE)
+    metadata = _load_metadata(sp_dir) if os.path.exists(zip_path) else {}
+    if metadata.get("url") != config.SP_PERMALINK:
+        metadata = {}  # other source: download unconditionally
+    if metadata and time.time() - metadata.get("checked", 0.0) < config.SP_MAX_AGE_DAYS * 86400:
+        return
+
+    headers = {}
+    if metadata.get("etag"):
+        headers["If-None-Match"] = metadata["etag"]
+    if metadata.get("last_modified"):
+        headers["If-Modified-Since"] = metadata["last_modified"]
+    with requests.get(config.SP_PERMALINK, headers=headers, stream=True,
+                      timeout=config.SP_DOWNLOAD_TIMEOUT) as response:
+        if response.status_code == 304:
+            logging.info(f"Service points file {zip_path} is up to date.")
+        else:
+            response.raise_for_status()
+            n_bytes, part_path = 0, zip_path + '.part'
+            try:
+                with open(part_path, mode='wb') as file:
+                    for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                        file.write(chunk)
+                        n_bytes += len(chunk)
+                _check_zip(part_path)
+            except BaseException:
+                if os.path.exists(part_path):
+                    os.remove(part_path)  # incomplete or invalid: keep the existing ZIP file
+                raise
+            os.replace(part_path, zip_path)
+            metadata = {"url": config.SP_PERMALINK, "etag": response.headers.get("ETag"),
+                        "last_modified": response.headers.get("Last-Modified")}
+            logging.info(f"Loaded service points zip file from {config.SP_PERMALINK}, {n_bytes} bytes.")
+    _save_metadata(sp_dir, dict(metadata, checked=time.time()))
+
+
+def _check_zip(path: str):
+    """Raise ValueError unless path is a ZIP file with a CSV member (e.g. not an HTML error page)."""
+    if not zipfile.is_zipfile(path):
+        raise ValueError("downloaded file is not a ZIP file")
+    with zipfile.ZipFile(path) as zip_file:
+        if not any(m.endswith('.csv') for m in zip_file.namelist()):
+            raise ValueError("downloaded ZIP file has no CSV file")
+
+
+def _has_sp_file(sp_dir: str) -> bool:
+    return any(f == SP_ZIP_FILE or f.endswith('.csv') for f in os.listdir(sp_dir))
+
+
+@contextmanager
+def _open_sp_csv(sp_dir: str):
+    """Open the service points CSV, yield (text file, path): the (first) CSV member of the ZIP file,
+    or else a CSV file in the folder (as unpacked by former versions)."""
+    zip_path = os.path.join(sp_dir, SP_ZIP_FILE)
+    if os.path.exists(zip_path):
+        with zipfile.ZipFile(zip_path) as zip_file:
+            member = next((m for m in zip_file.namelist() if m.endswith('.csv')), None)
+            if member is None:
+                raise ValueError(f"ERROR: load_sp() failed, no CSV file in {zip_path}")
+            with io.TextIOWrapper(zip_file.open(member), encoding='utf-8-sig', newline='') as csv_file:
+                yield csv_file, f"{zip_path}/{member}"
+        return
+    csv_files = sorted(f for f in os.listdir(sp_dir) if f.endswith('.csv'))
+    if not csv_files:
+        raise ValueError(f"ERROR: load_sp() failed, has no valid service points file in {sp_dir}")
+    sp_path = os.path.join(sp_dir, csv_files[0])
+    with open(file=sp_path, newline='', encoding='utf-8-sig') as csv_file:
+        yield csv_file, sp_path
+
+
 def _load_sp():
-    global sp_dict, sp_columns, keys
+    global sp_dict, sp_columns, _keys
 
     sp_dir = config.FOLDERS["stop_points"]
     if not os.path.exists(sp_dir):
         os.mkdir(sp_dir)
 
-    if len([f for f in os.listdir(sp_dir) if f.endswith(".csv")]) < 1:
-        sp_data = requests.get(config.SP_PERMALINK)
-        sp_zip_file = os.path.join(sp_dir, 'sp_temp.zip')
-        with open(sp_zip_file, mode='wb') as file:
-            file.write(sp_data.content)
-        logging.info(
-            f"Loaded service points zip file from {config.SP_PERMALINK}, {len(sp_data.content)} bytes.")
-        shutil.unpack_archive(sp_zip_file, sp_dir)
-        os.remove(sp_zip_file)
-        logging.info(f"Unzipped it to folder {sp_dir}.")
-
-    sp_file = os.listdir(sp_dir)[0]
-    sp_path = os.path.join(sp_dir, sp_file)
-    if not os.path.exists(sp_path) or sp_file[-4:] != ".csv":
-        raise f"ERROR: load_sp() failed, has no valid CSV service points file at {sp_path}"
+    try:
+        _refresh_zip(sp_dir)
+    except (requests.exceptions.RequestException, OSError, ValueError) as e:
+        if not _has_sp_file(sp_dir):
+            raise
+        logging.warning(f"Could not refresh service points from {config.SP_PERMALINK} ({e}), using the existing file.")
 
-    with open(file=sp_path, newline='', encoding='utf-8-sig') as csv_file:
+    with _open_sp_csv(sp_dir) as (csv_file, sp_path):
         csv_reader = csv.reader(csv_file, delimiter=';')
+        sp_columns = next(csv_reader)
+        column = {name: i for i, name in enumerate(sp_columns)}
+        i_sloid, i_country, i_stop_point = column["sloid"], column["uicCountryCode"], column["stopPoint"]
+        i_lon, i_lat, i_name, i_number = column["wgs84East"], column["wgs84North"], column["designationOfficial"], \
+            column["number"]
+        i_means = column.get("meansOfTransport")
         for row in csv_reader:
-            if sp_columns == None:
-                sp_columns = list(row)
-            if 'ch:1:sloid' in _sp_value(row, "sloid") and _sp_value(row, "uicCountryCode") == '85':  # Swiss SP only
-                if _sp_value(row, "stopPoint") == 'true':
-                    try:
-                        lon, lat = _sp_value(row, "wgs84East"), _sp_value(row, "wgs84North")
-                        if lon and lat:
-                            name = _sp_value(row, "designationOfficial")
-                            sp_dict[name] = StopPoint(_sp_value(row, "sloid"), int(_sp_value(row, "number")),
-                                                   name, float(lon), float(lat))
-                    except:
-                        logging.warning(f"WARN: ignore {row}")
-    keys = list(sp_dict.keys())
-    count = len(keys)
+            # Swiss stop points only:
+            if 'ch:1:sloid' in row[i_sloid] and row[i_country] == '85' and row[i_stop_point] == 'true':
+                try:
+                    lon, lat = row[i_lon], row[i_lat]
+                    if lon and lat:
+                        name = row[i_name]
+                        sp_dict[name] = StopPoint(row[i_sloid], int(row[i_number]), name, float(lon), float(lat),
+                                                  row[i_means] if i_means is not None else None)
+                except (ValueError, IndexError):
+                    logging.warning(f"WARN: ignore {row}")
+    _keys = list(sp_dict.keys())
+    count = len(_keys)
     logging.info(f"Loaded stop_points module with {count} Swiss stop points from file {sp_path}.")
 
 
-def _sp_value(row: list, column: str):
-    for i, x in enumerate(sp_columns):
-        if column == x:
-            return row[i]
-    return None
-
-
 class StopPoint:
-    def __init__(self, sloid: str, number: int, name: str, lon: float, lat: float):
+    def __init__(self, sloid: str, number: int, name: str, lon: float, lat: float, means_of_transport: str = None):
         self.number = number
         self.sloid = sloid
         self.name = name
         self.lon = lon
         self.lat = lat
+        # e.g. 'TRAIN|BUS', as given in the service points file:
+        self.means_of_transport = [m for m in (means_of_transport or '').split('|') if m]
 
 # call when the module is loaded:
 _load_sp()
\ No newline at end of file
@@ -0,0 +1,104 @@
+"""A module for popularity-weighted sampling of random stop points (origins, destinations, vias).
+
+By default, stop points are chosen uniformly, so a remote bus stop is as likely as Zürich HB.
+With parameter 'stop_weighting', the choice may be weighted instead:
+- uniform: all stop points are equally likely (default).
+- frequency: weights are taken from a CSV file in folder 'test_parameters' (parameter 'stop_frequency_file'),
+  with lines "stop name;weight". Stop points not in the file are never chosen.
+- category: weights by means of transport, as given in the service points file (see CATEGORY_WEIGHTS).
+- zipf: a Zipf distribution with exponent 'zipf_exponent' over the stop points, ranked by category,
+  ties in random (seeded) order.
+
+Draws go through a precomputed alias table, so each draw costs O(1), even with ~25k stop points.
+"""
+
+import csv
+import os
+import random
+
+import configuration as config
+from utilities import logging_wrapper as logging
+from utilities import object_store as store
+from utilities import stop_points
+from utilities.alias_table import AliasTable
+from utilities.math_utils import rng
+from utilities.parameters import param, param_true
+
+# relative weight of a stop point by its (most important) means of transport:
+CATEGORY_WEIGHTS = {
+    "TRAIN": 20.0,
+    "METRO": 8.0,
+    "TRAM": 4.0,
+    "BOAT": 2.0,
+    "RACK_RAILWAY": 2.0,
+    "CABLE_RAILWAY": 1.5,
+    "BUS": 1.0,
+}
+DEFAULT_CATEGORY_WEIGHT = 1.0
+
+
+def prepare_stop_sampler():
+    """Build the alias table for the weighting given by parameter 'stop_weighting' and put it into the store.
+    Call after the random seed is set, as the Zipf ranking uses random tie-breaking."""
+    weighting = param('stop_weighting').lower()
+    names = stop_points.keys()
+    if weighting == 'uniform':
+        store.put("stop_sampler", None)
+        return
+    elif weighting == 'frequency':
+        weights = _frequency_weights(names)
+    elif weighting == 'category':
+        weights = [_category_weight(stop_points.get_by_name(n)) for n in names]
+    elif weighting == 'zipf':
+        weights = _zipf_weights(names, param('zipf_exponent', float))
+    else:
+        raise ValueError(f"ERROR: unknown stop_weighting '{weighting}', use uniform, frequency, category or zipf.")
+
+    # origin, destination (and via) must be different stop points, else request_builder.build_request() would
+    # draw forever:
+    n_positive, n_needed = sum(w > 0.0 for w in weights), 3 if param_true('use_via') else 2
+    if n_positive < n_needed and not param_true('use_connections_file'):
+        raise ValueError(f"ERROR: stop_weighting '{weighting}' gives {n_positive} stop points a weight > 0, "
+                         f"at least {n_needed} are needed (origin, destination{', via' if n_needed == 3 else ''}).")
+    store.put("stop_sampler", (names, AliasTable(weights)))
+    logging.info(f"Stop points are sampled with '{weighting}' weighting ({n_positive} "
+                 f"of {len(names)} stop points with a weight > 0).")
+
+
+def draw_stop_name() -> str:
+    """Draw the name of a random stop point, weighted as prepared by prepare_stop_sampler(), else uniformly."""
+    sampler = store.fetch("stop_sampler")
+    if sampler is None:
+        names = stop_points.keys()
+        return names[rng().randrange(0, len(names))]
+    names, alias_table = sampler
+    return names[alias_table.sample(rng())]
+
+
+def _category_weight(sp) -> float:
+    return max([CATEGORY_WEIGHTS.get(m, DEFAULT_CATEGORY_WEIGHT) for m in sp.means_of_transport],
+               default=DEFAULT_CATEGORY_WEIGHT)
+
+
+def _zipf_weights(names: list, exponent: float) -> list:
+    tie_breakers = {n: random.random() for n in names}
+    ranked = sorted(names, key=lambda n: (-_category_weight(stop_points.get_by_name(n)), tie_breakers[n]))
+    rank_of = {n: rank for rank, n in enumerate(ranked, start=1)}
+    return [1.0 / (rank_of[n] ** exponent) for n in names]
+
+
+def _frequency_weights(names: list) -> list:
+    file_path = os.path.join(config.FOLDERS["test_parameters"], param('stop_frequency_file'))
+    frequencies = {}
+    with open(file=file_path, newline='', encoding='utf-8-sig') as file:
+        for row in csv.reader(file, delimiter=';'):
+            if len(row) >= 2 and not row[0].startswith('#'):
+                try:
+                    frequencies[row[0].strip()] = float(row[1])
+                except ValueError:
+                    pass  # e.g. a header line
+    unknown = [n for n in frequencies if stop_points.get_by_name(n) is None]
+    if unknown:
+        logging.warning(f"Stop frequency file {file_path}: no service point known for {unknown}, ignored.")
+    logging.info(f"Loaded stop frequency file {file_path} with {len(frequencies)} stop points.")
+    return [frequencies.get(n, 0.0) for n in names]
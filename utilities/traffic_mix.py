@@ -0,0 +1,42 @@
+"""Module for weighted, mixed-traffic scenarios.
+
+Instead of running each request type in its own sequential block, a traffic mix interleaves several
+request types at random within one run, in fixed proportions, as in production traffic.
+
+The mix is defined by the parameter 'traffic_mix', a comma-separated list of request_type:weight pairs,
+e.g. 'TR20:60, LIR20:25, SER20:10, TIR20:5'. Weights are relative, they need not add up to 100.
+A "+" suffix (e.g. 'TR20+:60') sends that request type with parameters, as in 'request_types'.
+"""
+
+from utilities.math_utils import rng
+from utilities.request_builder import request_type_w_or_wo_parameters_selector
+
+
+def parse_traffic_mix(text: str) -> list:
+    """Parse a traffic mix definition into a list of (request_type, use_pars, weight) tuples."""
+    mix = []
+    for entry in [e.strip() for e in text.split(',') if e.strip()]:
+        if ':' not in entry:
+            raise ValueError(f"ERROR in traffic_mix: entry '{entry}' must have the form request_type:weight.")
+        name, weight = [p.strip() for p in entry.rsplit(':', 1)]
+        rt, wo_w_pars = request_type_w_or_wo_parameters_selector(name)
+        if len(wo_w_pars) != 1:
+            raise ValueError(f"ERROR in traffic_mix: suffix '*' is not allowed in '{entry}', use '-' or '+'.")
+        if float(weight) <= 0.0:
+            raise ValueError(f"ERROR in traffic_mix: weight of '{entry}' must be positive.")
+        mix.append((rt, wo_w_pars[0], float(weight)))
+    if not mix:
+        raise ValueError("ERROR in traffic_mix: no request types given.")
+    return mix
+
+
+def select_from_mix(mix: list) -> (str, bool):
+    """Select a (request_type, use_pars) pair at random, according to the weights of the mix."""
+    rt, use_pars, _ = rng().choices(mix, weights=[w for _, _, w in mix])[0]
+    return rt, use_pars
+
+
+def mix_label(mix: list) -> str:
+    """A short, readable rendering of the mix in percent, e.g. 'TR20 60%, LIR20 25%'."""
+    total = sum(w for _, _, w in mix)
+    return ', '.join(f"{rt}{'+' if use_pars else ''} {round(100 * w / total)}%" for rt, use_pars, w in mix)